@@ -1,20 +1,36 @@
 import asyncio
+import hashlib
 import json
 import logging
 import os
+import re
+import time
+from datetime import date
 
 import aiofiles
 import aiosqlite
-from aiosqlite import IntegrityError
-from pydantic import ValidationError
 
-from validators import SupportCreate, UserCreate, AdminCreate
+from identity import IdentityCache
+from pool import ConnectionPool
+from reconcile import Reconciler
+from rotation import SkillRotation
+from task_queue import TaskQueue
+from validators import SupportBatch, UserCreate, AdminCreate
 
 
 class Admin:
-    def __init__(self, config):
+    def __init__(self, config, pool: ConnectionPool, task_queue: TaskQueue, rotation: SkillRotation,
+                 identity: IdentityCache):
         self.db = config['db']
+        self.pool = pool
+        self.task_queue = task_queue
+        self.rotation = rotation
+        self.identity = identity
+        self.__users = Reconciler('user', 'id', ('login', 'id', 'skill'), UserCreate, defaults={'num': 0})
+        self.__skills = Reconciler('user', 'id', ('id', 'skill'), UserCreate)
+        self.__admins = Reconciler('admin', 'id', ('login', 'id'), AdminCreate)
         asyncio.run(self.__create_database())
+        asyncio.run(self.__upgrade_database())
 
     async def __create_database(self):
         """
@@ -45,11 +61,13 @@ class Admin:
                     await db.execute("""CREATE TABLE IF NOT EXISTS "aiogram_state"(
                                                             "user" BIGINT NOT NULL PRIMARY KEY,
                                                             "chat" BIGINT NOT NULL,
-                                                            "state" TEXT NOT NULL)""")
+                                                            "state" TEXT NOT NULL,
+                                                            "touched" REAL)""")
                     await db.execute("""CREATE TABLE IF NOT EXISTS "aiogram_data"(
                                                         "user" BIGINT NOT NULL PRIMARY KEY,
                                                         "chat" BIGINT NOT NULL,
-                                                        "data" TEXT)""")
+                                                        "data" TEXT,
+                                                        "touched" REAL)""")
                     await db.execute("""CREATE TABLE IF NOT EXISTS "aiogram_bucket"(
                                                         "user" BIGINT NOT NULL PRIMARY KEY,
                                                         "chat" BIGINT NOT NULL,
@@ -59,6 +77,35 @@ class Admin:
             logging.error('An error occurred during create_database method execution: %s', e)
             raise e
 
+    async def __upgrade_database(self):
+        """
+        The method adds the tables missing in databases created by older versions
+        :return:
+        """
+        try:
+            async with aiosqlite.connect(self.db) as db:
+                # journal of the tasks handed out by TaskQueue
+                await db.execute('''
+                        CREATE TABLE IF NOT EXISTS claim
+                        (login text PRIMARY KEY, skill text, id int, date text)
+                ''')
+                # sheet writes waiting to be sent by Outbox
+                await db.execute('''
+                        CREATE TABLE IF NOT EXISTS outbox
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, key text UNIQUE, method text, kwargs text,
+                        attempts int, next_try real, created real, sent real, error text, cell text)
+                ''')
+                await db.execute('CREATE INDEX IF NOT EXISTS outbox_next_try ON outbox (sent, next_try)')
+                # fingerprints of the chunks of the sheets synchronized last
+                await db.execute('''
+                        CREATE TABLE IF NOT EXISTS sync_state
+                        (name text PRIMARY KEY, fingerprint text, updated real)
+                ''')
+                await db.commit()
+        except Exception as e:
+            logging.error('An error occurred during upgrade_database method execution: %s', e)
+            raise e
+
     async def check_access(self, id_telegram):
         """
         Method access verification
@@ -66,104 +113,226 @@ class Admin:
         :return:
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
-                cursor_object = await cursor.execute(f"""
-                                    select login from admin
-                                    where id == {id_telegram}
-                """)
-                result = await cursor_object.fetchone()
-                if result:
-                    return result
+            profile = await self.identity.get(id_telegram)
+            if profile.admin_login is not None:
+                return (profile.admin_login,)
         except Exception as e:
             logging.error('An error occurred during check_access method execution: %s', e)
             raise e
 
     async def set_user_language(self, id_telegram, language):
         try:
-            async with aiosqlite.connect(self.db) as cursor:
+            async with self.pool.acquire() as cursor:
                 await cursor.execute(
                     "REPLACE INTO localized (id, lang) VALUES (?, ?)", (id_telegram, language)
                 )
                 await cursor.commit()
+            self.identity.set_language(id_telegram, language)
         except Exception as e:
             logging.error('An error occurred during set_user_language method execution: %s', e)
             raise e
 
-    async def unloading(self, rows):
+    @staticmethod
+    async def __chunks(rows):
+        if hasattr(rows, '__aiter__'):
+            async for chunk in rows:
+                yield chunk
+        else:
+            yield rows
+
+    async def unloading(self, rows, force=False):
         """
-        Validation and writing of rows to the database
-        :param rows: upload lines
-        :return:
+        Validation and synchronization of rows with the database.
+        Only the difference with the task table is applied: new logins are inserted, changed rows are
+        updated keeping their priority, logins missing in the rows are deleted. Tasks claimed today
+        are not inserted again.
+        Every chunk is fingerprinted; the rows of chunks equal to the ones synchronized last today are
+        written to a temporary table and only validated once a chunk differs. If none differs, nothing is validated or applied
+        and the report only says the synchronization was skipped
+        :param rows: upload lines, or an async iterator of chunks of them
+        :param force: synchronize even if the rows did not change
+        :return: numbers of accepted, rejected and duplicated rows and of applied changes
         """
-        async with aiosqlite.connect(self.db) as cursor:
-            await cursor.execute("DELETE from task")
-            await cursor.commit()
-            for row in rows:
-                try:
-                    support = SupportCreate.from_list(row)
-                except (ValueError, ValidationError, IndexError):
+        # claims of previous days are released by a synchronization, so the day is part of the fingerprints
+        day = date.today().isoformat().encode()
+        report = {'accepted': 0, 'rejected': 0, 'duplicated': 0}
+        logins = set()
+        fingerprints = []
+        # chunks written to task_unchanged and not staged yet
+        unchanged = 0
+
+        columns = ('status', 'date', 'link', 'comment', 'skillsup', 'skill', 'output',
+                   'appreciated', 'autochecks', 'residue')
+        async with self.pool.acquire() as cursor:
+            async def stage(chunk):
+                batch = SupportBatch.validate(chunk)
+                report['rejected'] += len(batch.rejects)
+                supports = []
+                for support in batch.rows:
+                    login = support[2]
+                    if login in logins:
+                        report['duplicated'] += 1
+                        logging.warning(f"This login: {login} is duplicated in the support table.")
+                        continue
+                    logins.add(login)
+                    supports.append(support)
+                await cursor.executemany("""
+                    INSERT INTO task_staging (status, date, login,
+                     link, comment, skillsup, skill, output,
+                     appreciated, autochecks, residue, priority)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                """, supports)
+
+            async def stage_unchanged():
+                for index in range(unchanged):
+                    chunk = await cursor.execute_fetchall(
+                        "SELECT row FROM task_unchanged WHERE chunk = ? ORDER BY id", (index,))
+                    await stage([json.loads(i[0]) for i in chunk])
+                await cursor.execute("DELETE FROM task_unchanged")
+
+            stored = []
+            if not force:
+                state = await cursor.execute_fetchall("SELECT fingerprint FROM sync_state WHERE name = 'support'")
+                stored = json.loads(state[0][0]) if state else []
+            changed = force or not stored
+            await cursor.execute("CREATE TEMP TABLE IF NOT EXISTS task_staging AS SELECT * FROM main.task WHERE 0")
+            await cursor.execute("DELETE FROM task_staging")
+            await cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS task_unchanged (id INTEGER PRIMARY KEY, chunk int, row text)
+            """)
+            await cursor.execute("DELETE FROM task_unchanged")
+            # every changed chunk is validated and staged while the next one is fetched
+            async for chunk in self.__chunks(rows):
+                index = len(fingerprints)
+                fingerprints.append(hashlib.blake2b(day + json.dumps(chunk, ensure_ascii=False).encode(),
+                                                    digest_size=16).hexdigest())
+                if not changed and index < len(stored) and stored[index] == fingerprints[index]:
+                    await cursor.executemany("INSERT INTO task_unchanged (chunk, row) VALUES (?, ?)",
+                                             ((index, json.dumps(i, ensure_ascii=False)) for i in chunk))
+                    unchanged += 1
                     continue
-                try:
-                    await cursor.execute("""
-                        INSERT INTO task (status, date, login,
-                         link, comment, skillsup, skill, output, 
-                         appreciated, autochecks, residue)
-                        VALUES (:status, :date, :login,
-                         :link, :comment, :skillsup, :skill, :output, 
-                         :appreciated, :autochecks, :residue)
-                    """, support.model_dump())
-                except IntegrityError:
-                    logging.warning(f"This login: {support.login} is duplicated in the support table.")
+                if not changed:
+                    changed = True
+                    await stage_unchanged()
+                await stage(chunk)
 
+            if not changed and len(fingerprints) == len(stored):
+                await cursor.execute("DELETE FROM task_unchanged")
+                await cursor.commit()
+                logging.info("Synchronization of the task table skipped: the support sheet did not change")
+                return dict.fromkeys((*report, 'inserted', 'updated', 'deleted', 'claimed'), 0) | {'skipped': True}
+            # the sheet got shorter, the chunks left are all equal to the last ones
+            if not changed:
+                await stage_unchanged()
+            report['accepted'] = len(logins)
+
+            # claims of previous days no longer hold their logins back
+            await cursor.execute("DELETE FROM claim WHERE date != ?", (date.today().isoformat(),))
+            deleted = await cursor.execute_fetchall("""
+                DELETE FROM main.task
+                WHERE login NOT IN (SELECT login FROM task_staging)
+                RETURNING login
+            """)
+            updated = await cursor.execute_fetchall(f"""
+                UPDATE main.task
+                SET {', '.join(f'{i} = s.{i}' for i in columns)}
+                FROM task_staging AS s
+                WHERE s.login = task.login
+                 AND ({', '.join(f'task.{i}' for i in columns)}) IS NOT ({', '.join(f's.{i}' for i in columns)})
+                RETURNING *
+            """)
+            inserted = await cursor.execute_fetchall("""
+                INSERT INTO main.task
+                SELECT * FROM task_staging
+                WHERE login NOT IN (SELECT login FROM main.task)
+                 AND login NOT IN (SELECT login FROM claim)
+                RETURNING *
+            """)
+            claimed = await cursor.execute_fetchall("""
+                SELECT count(*) FROM task_staging
+                WHERE login IN (SELECT login FROM claim)
+            """)
+            await cursor.execute("DELETE FROM task_staging")
+            await cursor.execute("REPLACE INTO sync_state (name, fingerprint, updated) VALUES ('support', ?, ?)",
+                                 (json.dumps(fingerprints), time.time()))
             await cursor.commit()
+        await self.task_queue.apply([i[0] for i in deleted], [*updated, *inserted])
+        report.update(inserted=len(inserted), updated=len(updated), deleted=len(deleted), claimed=claimed[0][0])
+        logging.info(f"Synchronization of the task table: {report}")
+        return report
 
-    async def priority_setting(self, list_login):
+    async def priority_setting(self, list_login, priority=1):
         """
-        Changing the priority in the database for tasks
-        :param list_login:
-        :return:
+        Changing the priority in the database for tasks in one transaction
+        :param list_login: lines in the format "login" or "login level", the login * means all tasks
+        :param priority: level of the lines without one, 0 clears the priority
+        :return: results for every login
         """
-        async with aiosqlite.connect(self.db) as cursor:
-            update_priority = ""
-            try:
-                for i in list_login:
-                    await cursor.execute(f"""
-                                UPDATE task
-                                SET (priority) = (1)
-                                WHERE login == '{i}'
-                    """)
-                    await cursor.commit()
-                    cursor_object = await cursor.execute(f"""
-                    SELECT priority FROM task
-                     WHERE login == '{i}'""")
-                    priority_tuple = await cursor_object.fetchone()
-                    priority = '✅' if priority_tuple else '❌'
-                    update_priority += f'{i}:{priority}\n'
-                return update_priority
+        try:
+            priorities = {}
+            invalid = []
+            for line in list_login:
+                parts = line.split()
+                if not parts:
+                    continue
+                if len(parts) == 1:
+                    priorities[parts[0]] = priority
+                elif len(parts) == 2 and re.fullmatch(r'-?[0-9]+', parts[1]):
+                    priorities[parts[0]] = int(parts[1])
+                else:
+                    invalid.append(line.strip())
 
-            except Exception as e:
-                logging.error('An error occurred during priority_setting method execution: %s', e)
-                raise e
+            async with self.pool.acquire() as cursor:
+                if '*' in priorities:
+                    rows = await cursor.execute_fetchall("UPDATE task SET priority = ? RETURNING *",
+                                                         (priorities.pop('*'),))
+                    everything = len(rows)
+                else:
+                    everything = None
+                await cursor.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS priority_staging (login text PRIMARY KEY, priority int)
+                """)
+                await cursor.execute("DELETE FROM priority_staging")
+                await cursor.executemany("INSERT INTO priority_staging (login, priority) VALUES (?, ?)",
+                                         priorities.items())
+                updated = await cursor.execute_fetchall("""
+                    UPDATE main.task
+                    SET priority = s.priority
+                    FROM priority_staging AS s
+                    WHERE s.login = task.login
+                    RETURNING *
+                """)
+                await cursor.execute("DELETE FROM priority_staging")
+                await cursor.commit()
+            if everything is not None:
+                rows = {row[2]: row for row in rows}
+                rows.update((row[2], row) for row in updated)
+                updated = list(rows.values())
+            await self.task_queue.apply([], updated)
+
+            found = {row[2] for row in updated}
+            update_priority = "" if everything is None else f'*:{everything}\n'
+            for login, level in priorities.items():
+                update_priority += f'{login} {level}:{"✅" if login in found else "❌"}\n'
+            for line in invalid:
+                update_priority += f'{line}:❌\n'
+            return update_priority
+
+        except Exception as e:
+            logging.error('An error occurred during priority_setting method execution: %s', e)
+            raise e
 
     async def skills_update(self, list_user):
         """
         Updating user skills
         :param list_user: User list
-        :return:
+        :return: difference applied to the table
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
-                for i in list_user:
-                    try:
-                        user = UserCreate.from_list(i)
-                        await cursor.execute(f"""
-                                        UPDATE user
-                                        SET (skill) = ('{user.skill}')
-                                        where id == {user.id} 
-                        """)
-                    except (ValidationError, ValueError, IndexError):
-                        logging.warning(f'There was a problem with {i}')
-                await cursor.commit()
+            async with self.pool.acquire() as cursor:
+                diff = await self.__skills.apply(cursor, list_user, add=False, remove=False)
+            self.rotation.invalidate()
+            return diff.summary()
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
@@ -172,34 +341,14 @@ class Admin:
         """
         Compares user lists, deletes from the database if no user is found, or adds
         :param list_user: User list
-        :return:
+        :return: difference applied to the table
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
-                result = await cursor.execute_fetchall("""
-                                        SELECT * from user
-                        """)
-                user_from_database = [list(i[0:3]) for i in result]
-                for i in user_from_database:  # delete users
-                    if i not in list_user:
-                        await cursor.execute(f"""DELETE FROM user 
-                                            WHERE id == {i[1]}
-                        """)
-                await cursor.commit()
-
-                for i in list_user:
-                    try:
-                        user = UserCreate.from_list(i)
-                        if i not in user_from_database:  # add new users
-                            await cursor.execute("""
-                                            INSERT INTO user
-                                            VALUES (?,?,?,?)
-                            """, (user.login, user.id, user.skill, 0))
-                    except (ValidationError, ValueError, IndexError):
-                        logging.warning(f'There was a problem with {i}')
-                    except IntegrityError:
-                        logging.warning(f"This id: {user.id} is duplicated in the google table.")
-                await cursor.commit()
+            async with self.pool.acquire() as cursor:
+                diff = await self.__users.apply(cursor, list_user)
+            self.rotation.invalidate(diff.removed)
+            self.identity.apply_users(diff)
+            return diff.summary()
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
@@ -210,7 +359,7 @@ class Admin:
         :return:
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
+            async with self.pool.reader() as cursor:
                 users = await cursor.execute_fetchall("""
                                         SELECT * from user
                             """)
@@ -227,7 +376,7 @@ class Admin:
         :return:
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
+            async with self.pool.reader() as cursor:
                 users = await cursor.execute_fetchall("""
                                         SELECT id from user
                             """)
@@ -239,33 +388,13 @@ class Admin:
         """
         Compares lists of admin, removes from the database if no admin is found or adds.
         :param list_admin: User list
-        :return:
+        :return: difference applied to the table
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
-                result = await cursor.execute_fetchall("""
-                                        SELECT * from admin
-                        """)
-                admin_from_database = [list(i) for i in result]
-                for i in admin_from_database:  # delete admin
-                    if i not in list_admin:
-                        await cursor.execute(f"""
-                                        DELETE FROM admin
-                                        WHERE id == {i[1]}
-                        """)
-                await cursor.commit()
-
-                for i in list_admin:
-                    try:
-                        admin = AdminCreate.from_list(i)
-                        if i not in admin_from_database:  # add new admin
-                            await cursor.execute("""
-                                            INSERT INTO admin
-                                            VALUES (?,?)
-                            """, (admin.login, admin.id))
-                    except (ValidationError, ValueError, IndexError):
-                        logging.warning(f'There was a problem with {i}')
-                await cursor.commit()
+            async with self.pool.acquire() as cursor:
+                diff = await self.__admins.apply(cursor, list_admin)
+            self.identity.apply_admins(diff)
+            return diff.summary()
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class AppendQueue:
+    """
+    Collects rows appended to one worksheet and writes them with a single append_rows.
+
+    A batch is written when max_rows rows were collected or delay seconds after its first row.
+    put() returns a future resolved when the batch of the row is written, with the result
+    of the append and the position of the row in the batch. A row whose future was cancelled
+    before its batch is sent is not written.
+
+    Usage:
+
+    queue = AppendQueue(lambda rows: worksheet.append_rows(rows), delay=0.3, max_rows=100)
+    await queue.put(['login', '01.01.23'])
+    await queue.close()
+    """
+
+    def __init__(self, append: Callable[[List[list]], Awaitable], delay: float = 0.3, max_rows: int = 100):
+        self._append = append
+        self._delay = delay
+        self._max_rows = max_rows
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {'rows': 0, 'batches': 0, 'max_batch_size': 0, 'errors': 0}
+
+    def put(self, values: list) -> asyncio.Future:
+        """
+        Adds a row to the next batch
+        :param values: values of the row
+        :return: future of the write, resolved with the result of the append and the offset of the row
+        """
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._loop())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((values, future))
+        return future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self._delay
+        while len(batch) < self._max_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        while True:
+            collected = await self._collect()
+            # the caller of a cancelled row gave up on it and writes it again later
+            batch = [(values, future) for values, future in collected if not future.done()]
+            try:
+                if batch:
+                    result = await self._append([values for values, _ in batch])
+                    for offset, (_, future) in enumerate(batch):
+                        if not future.done():
+                            future.set_result((result, offset))
+            except Exception as e:
+                logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+                self._stats['errors'] += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in collected:
+                    self._queue.task_done()
+            if not batch:
+                continue
+            stats = self._stats
+            stats['rows'] += len(batch)
+            stats['batches'] += 1
+            stats['max_batch_size'] = max(stats['max_batch_size'], len(batch))
+
+    def stats(self) -> Dict:
+        """
+        :return: numbers of written rows, batches and failed batches
+        """
+        return dict(self._stats)
+
+    async def close(self, timeout: Optional[float] = None):
+        """
+        Writes the queued rows and stops the queue
+        :param timeout: seconds to wait for the queued rows, the rows still queued after it are dropped
+        """
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"{self._queue.qsize()} queued rows were not written before the queue was closed")
+        self._task.cancel()
+        self._task = None
@@ -18,6 +18,9 @@ from user import User
 from validators import TaskCreate
 from storage import SQLiteStorage
 from localized import Localized
+from identity import IdentityCache, IdentityMiddleware, Profile
+from pool import ConnectionPool
+from outbox import Outbox
 from asyncio import sleep
 
 
@@ -33,7 +36,7 @@ class Form(StatesGroup):
 
 
 class BotTelegram:
-    def __init__(self, config: dict, gs, db_admin, db_user, localized):
+    def __init__(self, config: dict, gs, db_admin, db_user, localized, pool, outbox):
         """
         Bot initialization with the given configuration
 
@@ -43,17 +46,28 @@ class BotTelegram:
             db_admin (Admin): Admin object for database interactions related to admin functionalities.
             db_user (User): User object for database interactions related to user functionalities.
             localized (Localized): Localized object for handling localization of messages and buttons.
-        """
-        self.storage = SQLiteStorage(config['db'])
+            pool (ConnectionPool): Database connection pool shared with db_admin and db_user.
+            outbox (Outbox): Outbox through which the results are written to Google Sheets.
+        """
+        self.pool: ConnectionPool = pool
+        self.outbox: Outbox = outbox
+        self.storage = SQLiteStorage(config['db'],
+                                     cache_size=config['fsm_cache_size'],
+                                     flush_interval=config['fsm_flush_interval'],
+                                     group_commit=config['fsm_group_commit'],
+                                     commit_delay=config['fsm_commit_delay'],
+                                     pool=pool)
+        self.fsm_ttl = config['fsm_ttl']
+        self.task_sync_interval = config['task_sync_interval']
         self.scheduler = AsyncIOScheduler()
         self.bot = Bot(token=config["token_bot"])
-        self.superusers = config["superusers"].split(",")
         self.dp = Dispatcher(self.bot, storage=self.storage)
         self.gs: SheetGoogle = gs
         self.feedback_id_chat = config['feedback_id']
         self.additional_id = config['additional_id']
         self.db_admin: Admin = db_admin
         self.db_user: User = db_user
+        self.identity: IdentityCache = db_user.identity
         self.localized: Localized = localized
 
         self.bot_commands = [
@@ -66,21 +80,22 @@ class BotTelegram:
         self.inline_button = InlineKeyboardMarkup(row_width=4)
         self.inline_button.add(self.button_lang_ru).add(self.button_lang_en)
 
-    async def start(self, message: types.Message):
+    async def start(self, message: types.Message, profile: Profile):
         """
         Method of processing the start command.
 
         Args:
             message (types.Message): The message object containing information about the user and chat.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
-        lang = await self.db_user.get_localized(message.from_user.id)
+        lang = profile.lang
         logging.info(f'The /start command from  @{message.from_user.username} '
                      f'(full name: {message.from_user.full_name})')
-        if str(message.from_user.id) in self.superusers or await self.db_admin.check_access(message.from_user.id):
+        if profile.is_admin:
             await message.reply(
                 f"{self.localized.get_message('hello', lang)}, {message.from_user.first_name}",
                 reply_markup=self.localized.get_keyboard('admin_button', lang))
-        elif await self.db_user.get_name(message.from_user.id):
+        elif profile.name:
             await message.reply(
                 f"{self.localized.get_message('hello', lang)}, {message.from_user.first_name}",
                 reply_markup=self.localized.get_keyboard('get_task_butt', lang))
@@ -125,44 +140,24 @@ class BotTelegram:
         await self.db_admin.set_user_language(user_id, language)
         await callback.answer(f"Язык изменен на / Language changed to: {language}")
 
-    async def get_job(self, message: types.Message, state: FSMContext):
+    async def get_job(self, message: types.Message, state: FSMContext, profile: Profile):
         """
         Method for sending a message with information about the support.
 
         Args:
             message (types.Message): The message object containing information about the user and chat.
             state (FSMContext): The state machine context for storing temporary data.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request for an assignment from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        lang = await self.db_user.get_localized(message.from_user.id)
+        lang = profile.lang
 
-        name = await self.db_user.get_name(message.from_user.id)
+        name = profile.name
         if name:
             task = await self.db_user.get_support_line(message.from_user.id)
             if isinstance(task, tuple):
                 time_now = date.today()
-                finished_form = {"ru": f"Статус : {task[0]}\n"
-                                       f"Дата начала оценки : {task[1]}\n"
-                                       f"Логин : {task[2]}\n"
-                                       f"Ссылка на оценку: <a href=\"{task[3]}\">{task[2]}</a>\n"
-                                       f"Примечание : {task[4]}\n"
-                                       f"Группа 2.0 : {task[5]}\n"
-                                       f"Выработка : {task[7]}\n"
-                                       f"Оценено : {task[8]}\n"
-                                       f"Автопроверки : {task[9]}\n"
-                                       f"Остаток : {task[10]}",
-                                 "en": f"Status : {task[0]}\n"
-                                       f"Date of assessment : {task[1]}\n"
-                                       f"Login : {task[2]}\n"
-                                       f"Evaluation link: <a href=\"{task[3]}\">{task[2]}</a>\n"
-                                       f"Note : {task[4]}\n"
-                                       f"Group 2.0 : {task[5]}\n"
-                                       f"Productivity : {task[7]}\n"
-                                       f"Assessed : {task[8]}\n"
-                                       f"Autotests : {task[9]}\n"
-                                       f"Remaining : {task[10]}"}
-
                 data_dict = {
                     'login_support': task[2],
                     'date': time_now.strftime('%d.%m.%y'),
@@ -172,29 +167,31 @@ class BotTelegram:
                     'timer': time.time(),
                     'comment': '',
                 }
-                await self.bot.send_message(message.from_user.id, text=finished_form[lang],
-                                            parse_mode='HTML',
-                                            reply_markup=self.localized.get_keyboard("button_change",
-                                                                                     lang))
+                card = await self.bot.send_message(message.from_user.id,
+                                                   text=self.localized.get_task_card(task, lang),
+                                                   parse_mode='HTML',
+                                                   reply_markup=self.localized.get_keyboard("button_change",
+                                                                                            lang))
                 logging.info(f"Task successfully completed {task[2]} for @{message.from_user.username} "
                              f"(full name: {message.from_user.full_name})")
                 await Form.number_tickets.set()
                 await self.bot.send_message(message.from_user.id,
                                             self.localized.get_message("count_tickets", lang),
                                             reply_markup=ReplyKeyboardRemove())
-                async with state.proxy() as data:
-                    data['data_dict'] = data_dict
+                # one sheet row per task card, even if the answer is delivered twice
+                await state.update_data(data_dict=data_dict, entry_key=f'{card.chat.id}:{card.message_id}')
             else:
                 await self.bot.send_message(message.from_user.id, task)
 
-    async def send_admin_message(self, message: types.Message):
+    async def send_admin_message(self, message: types.Message, profile: Profile):
         """
         Sends a message to all users from the admin.
 
         Args:
             message (types.Message): The message object containing the text to be sent.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
-        if str(message.from_user.id) in self.superusers:
+        if profile.superuser:
             notify = message.text.replace("/message", '')
             users = await self.db_admin.get_id_from_database()
             for i in users:
@@ -205,15 +202,16 @@ class BotTelegram:
                 finally:
                     await sleep(1)
 
-    async def number_of_tickets(self, message: types.Message, state: FSMContext):
+    async def number_of_tickets(self, message: types.Message, state: FSMContext, profile: Profile):
         """
-        Obtains the number of evaluated tickets and records it in Google Sheets.
+        Obtains the number of evaluated tickets and queues it for Google Sheets in the outbox.
 
         Args:
             message (types.Message): The message object containing the number of tickets.
             state (FSMContext): The state machine context for storing temporary data.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
-        lang = await self.db_user.get_localized(message.from_user.id)
+        lang = profile.lang
         if message.text.isdigit():
             if int(message.text) == 0:
                 await self.bot.send_message(message.from_user.id,
@@ -222,60 +220,57 @@ class BotTelegram:
                                                                                      lang))
                 await Form.comment.set()
             elif int(message.text) > 0:
-                time_mess = await self.bot.send_message(message.from_user.id,
-                                                        self.localized.get_message("waiting", lang))
-                async with state.proxy() as data:
-                    data_dict: dict = data['data_dict']
+                data = await state.get_data()
+                data_dict: dict = data['data_dict']
                 timer = time.time() - data_dict['timer']
                 data_dict.update({'quantity_viewed_ticket': int(message.text),
                                   'timer': timer
                                   })
-                await self.gs.spreadsheet_entry(**data_dict)
-                logging.info(f"Successful google table entry for a user @{message.from_user.username} "
+                await self.outbox.put('spreadsheet_entry', data_dict, key=data.get('entry_key'))
+                logging.info(f"Google table entry queued for a user @{message.from_user.username} "
                              f"(full name: {message.from_user.full_name})")
-                await time_mess.delete()
                 await state.finish()
                 await self.bot.send_message(message.from_user.id, self.localized.get_message("count_rec", lang),
                                             reply_markup=self.localized.get_keyboard("get_task_butt", lang))
         else:
             await self.bot.send_message(message.from_user.id, self.localized.get_message("error_int", lang))
 
-    async def comment(self, message: types.Message, state: FSMContext):
+    async def comment(self, message: types.Message, state: FSMContext, profile: Profile):
         """
         Records a comment if no ticket has been checked.
 
         Args:
             message (types.Message): The message object containing the comment.
             state (FSMContext): The state machine context for storing temporary data.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
-        lang = await self.db_user.get_localized(message.from_user.id)
-        time_mess = await self.bot.send_message(message.from_user.id, self.localized.get_message("waiting", lang))
-        async with state.proxy() as data:
-            data_dict: dict = data['data_dict']
+        lang = profile.lang
+        data = await state.get_data()
+        data_dict: dict = data['data_dict']
         timer = time.time() - data_dict['timer']
         data_dict.update({'comment': message.text,
                           'timer': timer,
                           })
-        await self.gs.spreadsheet_entry(**data_dict)
-        await time_mess.delete()
+        await self.outbox.put('spreadsheet_entry', data_dict, key=data.get('entry_key'))
         await state.finish()
         logging.info(f"Successful ticket skip, comment recorded for @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
         await message.reply(self.localized.get_message("comment_rec", lang),
                             reply_markup=self.localized.get_keyboard("get_task_butt", lang))
 
-    async def change_record_task(self, callback: types.CallbackQuery, state: FSMContext):
+    async def change_record_task(self, callback: types.CallbackQuery, state: FSMContext, profile: Profile):
         """
         Corrects the number of tickets already recorded.
 
         Args:
             callback (types.CallbackQuery): The callback query object containing information about the user and their selection.
             state (FSMContext): The state machine context for storing temporary data.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request to change the number of tickets for correction from @{callback.from_user.username} "
                      f"(full name: {callback.from_user.full_name})")
-        lang = await self.db_user.get_localized(callback.from_user.id)
-        name = await self.db_user.get_name(callback.from_user.id)
+        lang = profile.lang
+        name = profile.name
         if name:
             data_message = callback.message.date
             if data_message.date() == date.today():
@@ -283,8 +278,7 @@ class BotTelegram:
                 list_task = message.split("\n")
                 login = list_task[2].replace('Логин : ', '').replace("Login : ", '')
                 await Form.fix_numer_tickets.set()
-                async with state.proxy() as data:
-                    data['login'] = login
+                await state.update_data(login=login)
                 await self.bot.send_message(callback.from_user.id, self.localized.get_message("change_count", lang),
                                             reply_markup=self.localized.get_keyboard("button_cancel", lang))
                 await callback.answer('🖊')
@@ -293,22 +287,24 @@ class BotTelegram:
                                             self.localized.get_message("info_old_task", lang),
                                             reply_markup=self.localized.get_keyboard("get_task_butt", lang))
 
-    async def number_of_tickets_fixed(self, message: types.Message, state: FSMContext):
+    async def number_of_tickets_fixed(self, message: types.Message, state: FSMContext, profile: Profile):
         """
         Requests the number of tickets to be fixed.
 
         Args:
             message (types.Message): The message object containing the number of tickets to be fixed.
             state (FSMContext): The state machine context for storing temporary data.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
-        lang = await self.db_user.get_localized(message.from_user.id)
+        lang = profile.lang
         value = message.text
         if value.isdigit():
             time_message = await self.bot.send_message(message.from_user.id,
                                                        self.localized.get_message("waiting_change", lang))
-            async with state.proxy() as data:
-                login: dict = data['login']
-            result = await self.gs.change_number_tickets(login, str(message.from_user.id), value)
+            data = await state.get_data()
+            login: dict = data['login']
+            # a result that is still in the outbox is corrected there
+            result = await self.outbox.change_number_tickets(login, str(message.from_user.id), value)
             await time_message.delete()
             match result:
                 case 'Not found':
@@ -337,60 +333,80 @@ class BotTelegram:
         else:
             await message.reply(self.localized.get_message("wrong_count_ticket", lang))
 
-    async def __update_support_rows_for_database(self):
+    async def __update_support_rows_for_database(self, force: bool = False):
         """
         Updates the support lines in the database.
+
+        Args:
+            force (bool): Synchronize even if the sheet did not change since the last synchronization today.
+
+        Returns:
+            dict: Numbers of accepted, rejected and duplicated rows.
         """
         try:
-            rows = await self.gs.google_sheet_unloading_support_rows()
-            await self.db_admin.unloading(rows)
+            return await self.db_admin.unloading(self.gs.iter_support_rows(), force=force)
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
 
-    async def unloading_from_tables(self, message: types.Message):
+    async def __sweep_fsm_storage(self):
+        """
+        Deletes unfinished FSM sessions that were not touched during the TTL.
+        """
+        try:
+            deleted = await self.storage.sweep_expired(self.fsm_ttl * 3600)
+            if deleted:
+                logging.info(f"Expired FSM records deleted: {deleted}")
+        except Exception as e:
+            logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+
+    async def unloading_from_tables(self, message: types.Message, profile: Profile):
         """
         Updates the QC upload from the Google Sheets.
 
         Args:
             message (types.Message): The message object containing the request to unload data.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Table unload request from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        lang = await self.db_user.get_localized(message.from_user.id)
-        if str(message.from_user.id) in self.superusers:
+        lang = profile.lang
+        if profile.superuser:
             time_mess = await self.bot.send_message(message.from_user.id,
                                                     self.localized.get_message("unloading_wait", lang))
-            await self.__update_support_rows_for_database()
+            report = await self.__update_support_rows_for_database(force=True)
             logging.info(f"Successful upload for @{message.from_user.username} "
                          f"(full name: {message.from_user.full_name})")
             await time_mess.delete()
-            await message.reply(self.localized.get_message("success_unloading", lang))
+            await message.reply(f'{self.localized.get_message("success_unloading", lang)}\n'
+                                f'{self.localized.get_message("unloading_report", lang).format(**report)}')
 
-    async def priority_task(self, message: types.Message):
+    async def priority_task(self, message: types.Message, profile: Profile):
         """
         Updates the priority of tasks.
 
         Args:
             message (types.Message): The message object containing the request to update task priority.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request to change priority from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        lang = await self.db_user.get_localized(message.from_user.id)
-        if str(message.from_user.id) in self.superusers or await self.db_admin.check_access(message.from_user.id):
+        lang = profile.lang
+        if profile.is_admin:
             await self.bot.send_message(message.from_user.id,
                                         self.localized.get_message("send_login", lang))
             await Form.logins.set()
 
-    async def get_login_support(self, message: types.Message, state: FSMContext):
+    async def get_login_support(self, message: types.Message, state: FSMContext, profile: Profile):
         """
         Obtains and updates the priority of user logins.
 
         Args:
             message (types.Message): The message object containing the list of logins.
             state (FSMContext): The state machine context for storing temporary data.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
-        lang = await self.db_user.get_localized(message.from_user.id)
+        lang = profile.lang
         text = message.text
         list_login = text.split('\n')
         result = await self.db_admin.priority_setting(list_login)
@@ -399,82 +415,90 @@ class BotTelegram:
         logging.info(f"Successful priority change from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
 
-    async def user_update(self, message: types.Message):
+    async def user_update(self, message: types.Message, profile: Profile):
         """
         Updates the User table.
 
         Args:
             message (types.Message): The message object containing the request to update the user table.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request to update the list of users from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        lang = await self.db_user.get_localized(message.from_user.id)
-        if str(message.from_user.id) in self.superusers or await self.db_admin.check_access(message.from_user.id):
+        lang = profile.lang
+        if profile.is_admin:
             user_list = await self.gs.employee_skills_update()
-            await self.db_admin.user_update(user_list)
+            diff = await self.db_admin.user_update(user_list)
             logging.info(f"Successful update of the User base from @{message.from_user.username} "
                          f"(full name: {message.from_user.full_name})")
-            await message.reply(self.localized.get_message("update_db", lang))
+            await message.reply(f'{self.localized.get_message("update_db", lang)}\n'
+                                f'{self.localized.get_message("reconcile_report", lang).format(**diff)}')
 
-    async def user_skill_update(self, message: types.Message):
+    async def user_skill_update(self, message: types.Message, profile: Profile):
         """
         Updates user skills.
 
         Args:
             message (types.Message): The message object containing the request to update user skills.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request to update the list skill of users from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        lang = await self.db_user.get_localized(message.from_user.id)
-        if str(message.from_user.id) in self.superusers or await self.db_admin.check_access(message.from_user.id):
+        lang = profile.lang
+        if profile.is_admin:
             user_list = await self.gs.employee_skills_update()
-            await self.db_admin.skills_update(user_list)
+            diff = await self.db_admin.skills_update(user_list)
             logging.info(f"Successful update of the User base from @{message.from_user.username} "
                          f"(full name: {message.from_user.full_name})")
-            await message.reply(self.localized.get_message("update_db", lang))
+            await message.reply(f'{self.localized.get_message("update_db", lang)}\n'
+                                f'{self.localized.get_message("reconcile_report", lang).format(**diff)}')
 
-    async def user_info(self, message: types.Message):
+    async def user_info(self, message: types.Message, profile: Profile):
         """
         Retrieves and sends the list of users.
 
         Args:
             message (types.Message): The message object containing the request for the user list.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request for a list of users from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        if str(message.from_user.id) in self.superusers or await self.db_admin.check_access(message.from_user.id):
+        if profile.is_admin:
             await self.db_admin.get_user_from_database()
             await self.bot.send_document(message.from_user.id, open('db/user.json', 'rb'))
             logging.info(f"The file user.json has been sent to @{message.from_user.username} "
                          f"(full name: {message.from_user.full_name})")
 
-    async def admin_update(self, message: types.Message):
+    async def admin_update(self, message: types.Message, profile: Profile):
         """
         Updates the list of admins.
 
         Args:
             message (types.Message): The message object containing the request to update the admin list.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request to update the list of admins from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        lang = await self.db_user.get_localized(message.from_user.id)
-        if str(message.from_user.id) in self.superusers:
+        lang = profile.lang
+        if profile.superuser:
             list_admin = await self.gs.administrator_list_update()
-            await self.db_admin.admin_update(list_admin)
-            await message.reply(self.localized.get_message("update_db_root", lang))
+            diff = await self.db_admin.admin_update(list_admin)
+            await message.reply(f'{self.localized.get_message("update_db_root", lang)}\n'
+                                f'{self.localized.get_message("reconcile_report", lang).format(**diff)}')
             logging.info(f"Successful update of the Admin base from @{message.from_user.username} "
                          f"(full name: {message.from_user.full_name})")
 
-    async def get_log(self, message: types.Message):
+    async def get_log(self, message: types.Message, profile: Profile):
         """
         Retrieves and sends the log file.
 
         Args:
             message (types.Message): The message object containing the request to retrieve the log file.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"Request to unload logs from @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name})")
-        if str(message.from_user.id) in self.superusers:
+        if profile.superuser:
             await self.bot.send_document(message.from_user.id, open('log/chat.log', 'rb'))
 
     async def on_startup(self, dp: Dispatcher):
@@ -486,32 +510,73 @@ class BotTelegram:
         """
         await self.send_commands(dp)
         self.scheduler.add_job(self.__update_support_rows_for_database, 'cron', hour=1, minute=0)
+        if self.task_sync_interval:
+            self.scheduler.add_job(self.__update_support_rows_for_database, 'interval',
+                                   minutes=self.task_sync_interval)
+        if self.fsm_ttl:
+            self.scheduler.add_job(self.__sweep_fsm_storage, 'interval', minutes=30)
         self.scheduler.start()
+        self.outbox.start()
+
+    async def on_shutdown(self, dp: Dispatcher):
+        """
+        Stops the outbox, writes the queued sheet rows, the pending FSM changes and skill counters
+        and closes the database connections.
+
+        Args:
+            dp (Dispatcher): The dispatcher object for registering bot handlers and commands.
+        """
+        self.scheduler.shutdown(wait=False)
+        await self.outbox.close()
+        await self.gs.close(self.outbox.close_timeout)
+        await self.storage.close()
+        await self.db_user.rotation.close()
+        await self.pool.close()
+
+    async def get_stats(self, message: types.Message, profile: Profile):
+        """
+        Sends the database and sheet write statistics.
+
+        Args:
+            message (types.Message): The message object containing the request for the statistics.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
+        """
+        if profile.superuser:
+            sections = {'Database pool': self.pool.stats(),
+                        'FSM group commit': self.storage.write_stats(),
+                        'Sheet outbox': await self.outbox.stats(),
+                        'Sheets quota': self.gs.quota_stats(),
+                        **{f'Sheet appends {name}': stats for name, stats in self.gs.append_stats().items()}}
+            text = '\n\n'.join(f'{title}:\n' + '\n'.join(f'{key}: {value}' for key, value in stats.items())
+                                for title, stats in sections.items())
+            await message.reply(text)
 
-    async def forward_feedback(self, message: types.Message):
+    async def forward_feedback(self, message: types.Message, profile: Profile):
         """
         Forwards feedback to the feedback chat.
 
         Args:
             message (types.Message): The message object containing the feedback.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
         logging.info(f"The user @{message.from_user.username} "
                      f"(full name: {message.from_user.full_name}) sent the file")
-        lang = await self.db_user.get_localized(message.from_user.id)
-        if await self.db_user.get_name(message.from_user.id):
+        lang = profile.lang
+        if profile.name:
             await self.bot.forward_message(self.feedback_id_chat, message.from_user.id, message.message_id)
             await message.reply(self.localized.get_message("get_oc", lang))
 
-    async def additional_task(self, message: types.Message):
+    async def additional_task(self, message: types.Message, profile: Profile):
         """
         Processes and records additional tasks.
 
         Args:
             message (types.Message): The message object containing the additional task details.
+            profile (Profile): Profile of the sender attached by IdentityMiddleware.
         """
-        lang = await self.db_user.get_localized(message.from_user.id)
+        lang = profile.lang
         if str(message.chat.id) == self.additional_id:
-            if await self.db_user.get_name(message.from_user.id):
+            if profile.name:
                 logging.info(f"A new task has been sent from @{message.from_user.username} "
                              f"(full name: {message.from_user.full_name})")
                 text_chunks = message.text.split('\n')
@@ -519,13 +584,13 @@ class BotTelegram:
                 try:
                     task = TaskCreate.from_list(text_chunks)
                     check_task = task.model_dump()
-                    await self.gs.addition_task_entry(
-                        check_task['login'],
-                        check_task['task'],
-                        check_task['date'],
-                        check_task['quantity']
-                    )
-                    logging.info(f"The task is recorded in a google doc for @{message.from_user.username} "
+                    await self.outbox.put('addition_task_entry',
+                                          {'login': check_task['login'],
+                                           'task': check_task['task'],
+                                           'date': check_task['date'],
+                                           'quantity': check_task['quantity']},
+                                          key=f'{message.chat.id}:{message.message_id}')
+                    logging.info(f"The task is queued for a google doc for @{message.from_user.username} "
                                  f"(full name: {message.from_user.full_name})")
                 except (ValidationError, IndexError):
                     await message.reply(self.localized.get_message("wrong_add_task", lang))
@@ -550,9 +615,11 @@ class BotTelegram:
         Args:
             dp (Dispatcher): The dispatcher object for registering bot handlers and commands.
         """
+        dp.middleware.setup(IdentityMiddleware(self.identity))
         dp.register_message_handler(self.start, commands="start")
         dp.register_message_handler(self.set_language, commands="switch_language")
         dp.register_message_handler(self.send_admin_message, commands='message')
+        dp.register_message_handler(self.get_stats, commands='stats')
         dp.register_message_handler(self.get_job, text=["Получить задание", "Get Task"], state=None)
         dp.register_message_handler(self.number_of_tickets, content_types='text', state=Form.number_tickets)
         dp.register_message_handler(self.comment, content_types='text', state=Form.comment)
@@ -578,4 +645,5 @@ class BotTelegram:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         self._reg_handlers(self.dp)
-        executor.start_polling(self.dp, skip_updates=True, on_startup=self.on_startup, loop=loop)
+        executor.start_polling(self.dp, skip_updates=True, on_startup=self.on_startup,
+                               on_shutdown=self.on_shutdown, loop=loop)
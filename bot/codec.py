@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import timeit
+from typing import Dict
+
+import jsonpickle
+
+
+class JsonCodec:
+    """
+    Compact JSON encoding of FSM data and buckets.
+
+    Encoded values start with a version byte, so rows written by other codecs
+    (and old rows without a version byte) are still decoded.
+    """
+    version = '\x01'
+
+    def encode(self, data: Dict) -> str:
+        return self.version + json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+    def decode(self, blob: str) -> Dict:
+        return json.loads(blob[1:])
+
+
+class JsonPickleCodec:
+    """
+    Encoding used by the storage before the codecs were added. Values are stored without a version byte
+    """
+    version = ''
+
+    def encode(self, data: Dict) -> str:
+        return jsonpickle.encode(data)
+
+    def decode(self, blob: str) -> Dict:
+        return jsonpickle.decode(blob)
+
+
+CODECS = {JsonCodec.version: JsonCodec()}
+LEGACY_CODEC = JsonPickleCodec()
+
+
+def decode(blob: str, codecs: Dict[str, object] = CODECS) -> Dict:
+    """
+    Decodes a value written by any known codec
+    :param blob: value from the data or bucket column
+    :param codecs: version byte -> codec, the built-in codecs by default
+    :return: decoded dict
+    """
+    codec = codecs.get(blob[:1], LEGACY_CODEC)
+    return codec.decode(blob)
+
+
+def benchmark(number: int = 10000):
+    """
+    Compares the codecs on the payloads the bot keeps in the FSM storage
+    :param number: number of encode/decode calls per payload
+    """
+    payloads = {
+        'data_dict': {'data_dict': {'login_support': 'support_login', 'date': '18.10.26',
+                                    'login_kk': 'auditor_login', 'id_telegram': 123456789,
+                                    'quantity_viewed_ticket': 0, 'timer': time.time(), 'comment': ''}},
+        'login': {'login': 'support_login'},
+    }
+    for name, payload in payloads.items():
+        for codec in (LEGACY_CODEC, JsonCodec()):
+            blob = codec.encode(payload)
+            encode_time = timeit.timeit(lambda: codec.encode(payload), number=number)
+            decode_time = timeit.timeit(lambda: decode(blob), number=number)
+            print(f'{name:<10} {codec.__class__.__name__:<15} size={len(blob.encode()):>4} B  '
+                  f'encode={encode_time / number * 1e6:7.2f} us  decode={decode_time / number * 1e6:7.2f} us')
+
+
+async def migrate(db_path: str):
+    from storage import SQLiteStorage
+
+    storage = SQLiteStorage(db_path)
+    try:
+        rewritten = await storage.migrate_codec()
+        print(f'Rewritten rows: {rewritten}')
+    finally:
+        await storage.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FSM storage codecs')
+    parser.add_argument('command', choices=['migrate', 'benchmark'])
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        asyncio.run(migrate(os.environ['DB_PATH']))
+    else:
+        benchmark()
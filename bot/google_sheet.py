@@ -1,11 +1,28 @@
+import asyncio
 import logging
+import time
+from datetime import date as dt
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from google.oauth2.service_account import Credentials
-from gspread_asyncio import AsyncioGspreadClientManager
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from gspread_asyncio import AsyncioGspreadWorksheet
 
+from append_queue import AppendQueue
+from quota import READS, RESULTS, SYNC, QuotaClientManager
 
+# statuses after which the cached handles are opened again: expired authorization, deleted or moved sheet
+REFRESH_STATUSES = (401, 404)
+# rows above the last appended one searched by change_number_tickets when the row is not known,
+# the rows above them are not searched
+SEARCH_ROWS = 500
+
+
+@lru_cache(maxsize=None)
 def get_creds():
-    # To obtain a service account JSON file
+    # To obtain a service account JSON file, read once: the client manager only refreshes the token
     creds = Credentials.from_service_account_file("credentials.json")
     scoped = creds.with_scopes([
         "https://spreadsheets.google.com/feeds",
@@ -21,7 +38,21 @@ class SheetGoogle:
         Initialization of spreadsheets with specified configuration
         :param config: dictionary with configurations for tables
         """
-        self.__agsm = AsyncioGspreadClientManager(get_creds)
+        self.__agsm = QuotaClientManager(get_creds, rate=config.get('quota_rate', 60),
+                                         burst=config.get('quota_burst', 5))
+        self.__worksheets: Dict[str, Tuple[AsyncioGspreadWorksheet, float]] = {}
+        self.worksheet_ttl = config.get('worksheet_ttl', 3600)
+        self.append_delay = config.get('append_delay', 0.3)
+        self.append_batch_size = config.get('append_batch_size', 100)
+        self.chunk_rows = config.get('chunk_rows', 5000)
+        self.snapshot_ttl = config.get('snapshot_ttl', 10)
+        self.write_attempts = config.get('write_attempts', 3)
+        self.__snapshot: Dict[str, Tuple[list, float]] = {}
+        self.__snapshot_pending: Dict[str, asyncio.Future] = {}
+        self.__appends: Dict[Tuple[str, str], AppendQueue] = {}
+        # date -> (support login, telegram id) -> (row, column) of the rows appended to the task sheet
+        self.__rows: Dict[str, Dict[Tuple[str, str], Tuple[int, int]]] = {}
+        self.__last_row: Optional[int] = None
         self.table_id = config["table_id"]
         self.task_sheet_name = config['task_sheet_name']
         self.task_begin_column = config['task_begin_column']
@@ -30,6 +61,9 @@ class SheetGoogle:
         self.addition_sheet_name = config['addition_sheet_name']
         self.addition_begin_column = config['addition_begin_column']
         self.head_task = config['head_task']
+        # name -> range read by snapshot(), the support sheet is streamed by iter_support_rows()
+        self.snapshot_ranges = {'users': (self.user_sheet_name, 'A:C'),
+                                'admins': (self.admin_sheet_name, 'A:B')}
 
     async def __authorize(self, table_id):
         """
@@ -41,10 +75,173 @@ class SheetGoogle:
         ss = await agc.open_by_key(table_id)
         return ss
 
+    async def __worksheet(self, name: str, refresh: bool = False) -> AsyncioGspreadWorksheet:
+        """
+        Returns the cached worksheet handle, it is opened again after worksheet_ttl seconds
+        :param name: worksheet name
+        :param refresh: open the spreadsheet with a new client
+        :return: worksheet
+        """
+        cached = self.__worksheets.get(name)
+        if cached is not None and not refresh and cached[1] > time.monotonic():
+            return cached[0]
+        if refresh:
+            # the client manager keeps the opened spreadsheets per client, a new client opens them again
+            self.__agsm.auth_time = None
+        ss = await self.__authorize(self.table_id)
+        worksheet = await ss.worksheet(name)
+        self.__worksheets[name] = (worksheet, time.monotonic() + self.worksheet_ttl)
+        return worksheet
+
+    async def __call(self, name: str, method: Callable[[AsyncioGspreadWorksheet], Awaitable]):
+        """
+        Calls the method with the worksheet, once more with a refreshed handle if authorization
+        expired or the sheet was not found
+        :param name: worksheet name
+        :param method: coroutine function taking the worksheet
+        :return: result of the method
+        """
+        try:
+            return await method(await self.__worksheet(name))
+        except APIError as e:
+            if e.response.status_code not in REFRESH_STATUSES:
+                raise
+            logging.warning(f"Refreshing the worksheet {name}: {e.__class__.__name__} - {e}")
+            self.__worksheets.pop(name, None)
+            return await method(await self.__worksheet(name, refresh=True))
+
+    async def __fetch_snapshot(self, names: List[str]):
+        """
+        Reads the ranges of the names with one values_batch_get
+        """
+        ranges = [f"'{sheet.replace(chr(39), chr(39) * 2)}'!{cells}"
+                  for sheet, cells in (self.snapshot_ranges[i] for i in names)]
+        try:
+            try:
+                ss = await self.__authorize(self.table_id)
+                response = await ss.values_batch_get(ranges)
+            except APIError as e:
+                if e.response.status_code not in REFRESH_STATUSES:
+                    raise
+                logging.warning(f"Refreshing the spreadsheet: {e.__class__.__name__} - {e}")
+                self.__agsm.auth_time = None
+                ss = await self.__authorize(self.table_id)
+                response = await ss.values_batch_get(ranges)
+            expires = time.monotonic() + self.snapshot_ttl
+            for name, value_range in zip(names, response.get('valueRanges', [])):
+                self.__snapshot[name] = (value_range.get('values', []), expires)
+        finally:
+            for name in names:
+                self.__snapshot_pending.pop(name, None)
+
+    async def snapshot(self, *names: str) -> Dict[str, list]:
+        """
+        Returns the rows of the users and admins ranges. The ranges older than snapshot_ttl
+        seconds are read with one request, concurrent calls wait for the same request.
+        The rows are shared between the callers and must not be changed
+        :param names: names of snapshot_ranges, all of them by default
+        :return: name -> rows
+        """
+        names = names or tuple(self.snapshot_ranges)
+        now = time.monotonic()
+        missing = [i for i in names if i not in self.__snapshot or self.__snapshot[i][1] <= now]
+        if missing:
+            waiting = {self.__snapshot_pending[i] for i in missing if i in self.__snapshot_pending}
+            fetch = [i for i in missing if i not in self.__snapshot_pending]
+            if fetch:
+                # the task copies the lane, the snapshot is read on the lane of the admin reads
+                with self.__agsm.lane(READS):
+                    future = asyncio.ensure_future(self.__fetch_snapshot(fetch))
+                for name in fetch:
+                    self.__snapshot_pending[name] = future
+                waiting.add(future)
+            await asyncio.gather(*waiting)
+        return {i: self.__snapshot[i][0] for i in names}
+
+    def __append(self, name: str, table_range: str, values: list) -> asyncio.Future:
+        """
+        Queues a row for the next append_rows to the worksheet
+        :param name: worksheet name
+        :param table_range: range in which the table is looked for
+        :param values: values of the row
+        :return: future of the write
+        """
+        async def append(rows):
+            # a write that keeps failing is raised to the outbox, which retries it with backoff
+            with self.__agsm.lane(RESULTS), self.__agsm.attempts(self.write_attempts):
+                return await self.__call(name, lambda ws: ws.append_rows(rows, table_range=table_range))
+
+        queue = self.__appends.get((name, table_range))
+        if queue is None:
+            queue = AppendQueue(append, delay=self.append_delay, max_rows=self.append_batch_size)
+            self.__appends[(name, table_range)] = queue
+        return queue.put(values)
+
+    def append_stats(self) -> Dict:
+        """
+        :return: statistics of the append queues by worksheet
+        """
+        return {name: queue.stats() for (name, _), queue in self.__appends.items()}
+
+    def quota_stats(self) -> Dict:
+        """
+        :return: statistics of the request lanes of the client manager
+        """
+        return self.__agsm.stats()
+
+    async def close(self, timeout: Optional[float] = None):
+        """
+        Writes the queued rows
+        :param timeout: seconds to wait for the rows of every worksheet
+        """
+        for queue in self.__appends.values():
+            await queue.close(timeout)
+
+    def __index_row(self, result, offset: int, login_support: str, date: str,
+                    id_telegram) -> Optional[Tuple[int, int]]:
+        """
+        Remembers the row of an appended task from the updatedRange of the append
+        :return: (row, column) of the task or None if the range is unknown
+        """
+        try:
+            start = result['updates']['updatedRange'].split('!')[-1].split(':')[0]
+            row, col = a1_to_rowcol(start)
+        except (KeyError, TypeError, IndexError, AttributeError):
+            return None
+        row += offset
+        self.__last_row = max(self.__last_row or 0, row)
+        # corrections are only allowed on the day of the task, a row of an earlier day
+        # retried by the outbox is not indexed and does not drop the rows of today
+        if date != dt.today().strftime('%d.%m.%y'):
+            return row, col
+        for key in [i for i in self.__rows if i != date]:
+            del self.__rows[key]
+        self.__rows.setdefault(date, {})[(login_support, str(id_telegram))] = (row, col)
+        return row, col
+
+    async def __find_row(self, selected_sheet, support_login: str, telegram_id: str):
+        """
+        Looks for the last row of the login among the SEARCH_ROWS rows up to the last appended one
+        :return: (row, column) or None if the row is not there, no row was appended since the start
+        or the last row of the login belongs to another user
+        """
+        if not self.__last_row:
+            return None
+        col = a1_to_rowcol(self.task_begin_column)[1]
+        first = max(1, self.__last_row - SEARCH_ROWS + 1)
+        rows = await selected_sheet.get(f'{rowcol_to_a1(first, col)}:{rowcol_to_a1(self.__last_row, col + 3)}')
+        for number in range(len(rows) - 1, -1, -1):
+            if rows[number] and rows[number][0] == support_login:
+                if len(rows[number]) < 4 or rows[number][3] != telegram_id:
+                    return None
+                return first + number, col
+        return None
+
     async def spreadsheet_entry(self, login_support: str, date: str, login_kk: str, id_telegram: int,
                                 quantity_viewed_ticket: int, timer, comment=""):
         """
-        Writing the result of the assessment in a google spreadsheet
+        Writing the result of the assessment in a google spreadsheet.
+        Rows written at the same time are appended together
         :param login_support: support login
         :param date: assessment date
         :param login_kk: quality control login
@@ -52,7 +249,7 @@ class SheetGoogle:
         :param quantity_viewed_ticket: number of tickets
         :param comment:
         :param timer:
-        :return:
+        :return: [row, column] of the written row or None if the append did not report it
         """
         try:
             values = [login_support,
@@ -63,10 +260,9 @@ class SheetGoogle:
                       timer,
                       comment]
 
-            ss = await self.__authorize(self.table_id)
-
-            selected_sheet = await ss.worksheet(self.task_sheet_name)
-            await selected_sheet.append_row(values=values, table_range=self.task_begin_column)
+            result, offset = await self.__append(self.task_sheet_name, self.task_begin_column, values)
+            cell = self.__index_row(result, offset, login_support, date, id_telegram)
+            return list(cell) if cell else None
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
@@ -81,28 +277,48 @@ class SheetGoogle:
         :return:
         """
         try:
-            ss = await self.__authorize(self.table_id)
-
-            selected_sheet = await ss.worksheet(self.addition_sheet_name)
-            await selected_sheet.append_row(values=[login, task, date, quantity],
-                                            table_range=self.addition_begin_column)
+            await self.__append(self.addition_sheet_name, self.addition_begin_column, [login, task, date, quantity])
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
 
-    async def google_sheet_unloading_support_rows(self):
+    async def iter_rows(self, name: str, first_column: str, last_column: str) -> AsyncIterator[List[list]]:
         """
-        Extracts all rows from Google table
+        Reads the worksheet in windows of chunk_rows rows on the lane of the synchronizations.
+        The next window is requested while the current one is processed
+        :param name: worksheet name
+        :param first_column: first column of the range
+        :param last_column: last column of the range
+        :return: async iterator of the chunks of rows
         """
+        async def fetch(start):
+            async def window(ws):
+                rows = await ws.get(f'{first_column}{start}:{last_column}{start + self.chunk_rows - 1}')
+                return rows, ws.row_count
+            with self.__agsm.lane(SYNC):
+                return await self.__call(name, window)
+
+        start = 1
+        task = asyncio.ensure_future(fetch(start))
         try:
-            ss = await self.__authorize(self.table_id)
-            selected_sheet = await ss.worksheet(self.head_task)
-            rows = await selected_sheet.get("A:K")
-            return rows
-        except Exception as e:
-            logging.error(
-                f"An error occurred: {e.__class__.__name__} - {e}")
-            raise e
+            while True:
+                rows, row_count = await task
+                # windows inside the grid may be empty, the first empty one after it is the end
+                if not rows and start > row_count:
+                    break
+                start += self.chunk_rows
+                task = asyncio.ensure_future(fetch(start))
+                if rows:
+                    yield rows
+        finally:
+            task.cancel()
+
+    async def iter_support_rows(self) -> AsyncIterator[List[list]]:
+        """
+        Reads the A:K range of the support sheet in chunks
+        """
+        async for rows in self.iter_rows(self.head_task, 'A', 'K'):
+            yield rows
 
     async def employee_skills_update(self):
         """
@@ -110,9 +326,8 @@ class SheetGoogle:
         :return: employee list
         """
         try:
-            ss = await self.__authorize(self.table_id)
-            selected_sheet = await ss.worksheet(self.user_sheet_name)
-            result = await selected_sheet.get("A:C")
+            # the admins are read together with the users, the next update of either takes them from the snapshot
+            result = (await self.snapshot('users', 'admins'))['users']
 
             return result
         except Exception as e:
@@ -125,9 +340,7 @@ class SheetGoogle:
         :return: list of administrators
         """
         try:
-            ss = await self.__authorize(self.table_id)
-            selected_sheet = await ss.worksheet(self.admin_sheet_name)
-            result = await selected_sheet.get("A:B")
+            result = (await self.snapshot('users', 'admins'))['admins']
 
             return result
         except Exception as e:
@@ -135,24 +348,29 @@ class SheetGoogle:
                 f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
 
-    async def change_number_tickets(self, support_login, telegram_id, value):
+    async def change_number_tickets(self, support_login, telegram_id, value, cell=None):
         """
         Makes changes to already recorded tasks
         :param support_login: support login from the message
         :param value: ticket quantity
         :param telegram_id: user id telegram
+        :param cell: [row, column] of the task returned by spreadsheet_entry, if known
         :return:
         """
-        try:
-            ss = await self.__authorize(self.table_id)
-            selected_sheet = await ss.worksheet(self.task_sheet_name)
-            cell_list = await selected_sheet.findall(f'{support_login}')
-            cell = cell_list[-1]
-            get_user_id = await selected_sheet.cell(cell.row, cell.col + 3)
-            if get_user_id.value != telegram_id:
-                return 'Not found'
-            await selected_sheet.update_cell(cell.row, cell.col + 4, value)
+        async def change(selected_sheet):
+            nonlocal cell
+            today = dt.today().strftime('%d.%m.%y')
+            cell = cell or self.__rows.get(today, {}).get((support_login, str(telegram_id)))
+            if cell is None:
+                cell = await self.__find_row(selected_sheet, support_login, str(telegram_id))
+                if cell is None:
+                    return 'Not found'
+            await selected_sheet.update_cell(cell[0], cell[1] + 4, value)
             return 'Successful'
+
+        try:
+            with self.__agsm.lane(RESULTS), self.__agsm.attempts(self.write_attempts):
+                return await self.__call(self.task_sheet_name, change)
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             return 'Error'
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from pool import ConnectionPool
+
+
+class Profile:
+    """
+    What the bot knows about a telegram user.
+
+    Attributes:
+        id (int): user id telegram.
+        name (str): login of the user table or None.
+        admin_login (str): login of the admin table or None.
+        lang (str): language of the messages.
+        superuser (bool): whether the id is listed in SUPERUSER.
+    """
+
+    __slots__ = ('id', 'name', 'admin_login', 'lang', 'superuser')
+
+    def __init__(self, id_telegram: int, name: Optional[str], admin_login: Optional[str], lang: str,
+                 superuser: bool):
+        self.id = id_telegram
+        self.name = name
+        self.admin_login = admin_login
+        self.lang = lang
+        self.superuser = superuser
+
+    @property
+    def is_admin(self) -> bool:
+        return self.superuser or self.admin_login is not None
+
+
+class IdentityCache:
+    """
+    Users, admins and languages loaded in one query and kept in memory.
+
+    Admin keeps it up to date: user_update and admin_update apply their diffs,
+    set_user_language the new language.
+    """
+
+    def __init__(self, pool: ConnectionPool, superusers: Iterable[str] = (), default_lang: str = 'ru'):
+        self.pool = pool
+        self.superusers = frozenset(i.strip() for i in superusers if i.strip())
+        self.default_lang = default_lang
+        self._names: Dict[int, str] = {}
+        self._admins: Dict[int, str] = {}
+        self._langs: Dict[int, str] = {}
+        self._loaded = False
+        # changed by every update, a load that overlapped an update is repeated
+        self._version = 0
+        self._load_lock = asyncio.Lock()
+
+    async def load(self):
+        """
+        Loads the user, admin and localized tables
+        """
+        version = None
+        while version != self._version:
+            version = self._version
+            async with self.pool.reader() as cursor:
+                rows = await cursor.execute_fetchall("""
+                    SELECT 'user', id, login FROM user
+                    UNION ALL SELECT 'admin', id, login FROM admin
+                    UNION ALL SELECT 'lang', id, lang FROM localized
+                """)
+        tables = {'user': {}, 'admin': {}, 'lang': {}}
+        for table, id_telegram, value in rows:
+            tables[table][id_telegram] = value
+        self._names, self._admins, self._langs = tables['user'], tables['admin'], tables['lang']
+        self._loaded = True
+        logging.info(f"Identity cache loaded: {len(self._names)} users, {len(self._admins)} admins")
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await self.load()
+
+    async def get(self, id_telegram: int) -> Profile:
+        """
+        :param id_telegram: user id telegram
+        :return: profile of the user
+        """
+        await self._ensure_loaded()
+        return Profile(id_telegram, self._names.get(id_telegram), self._admins.get(id_telegram),
+                       self._langs.get(id_telegram, self.default_lang), str(id_telegram) in self.superusers)
+
+    def _apply(self, table: Dict[int, str], diff):
+        self._version += 1
+        for id_telegram in diff.removed:
+            table.pop(id_telegram, None)
+        for values in (diff.added, diff.changed):
+            for id_telegram, (login, *_) in values.items():
+                table[id_telegram] = login
+
+    def apply_users(self, diff):
+        """
+        :param diff: Diff of the user table with the login as the first value
+        """
+        self._apply(self._names, diff)
+
+    def apply_admins(self, diff):
+        """
+        :param diff: Diff of the admin table with the login as the first value
+        """
+        self._apply(self._admins, diff)
+
+    def set_language(self, id_telegram: int, language: str):
+        self._version += 1
+        self._langs[id_telegram] = language
+
+
+class IdentityMiddleware(BaseMiddleware):
+    """
+    Passes the profile of the sender to the handlers that take a profile argument
+    """
+
+    def __init__(self, identity: IdentityCache):
+        super().__init__()
+        self.identity = identity
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        data['profile'] = await self.identity.get(message.from_user.id)
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        data['profile'] = await self.identity.get(callback.from_user.id)
@@ -1,3 +1,5 @@
+from types import MappingProxyType
+
 from aiogram.types import (KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove,
                            InlineKeyboardMarkup, InlineKeyboardButton)
 
@@ -16,6 +18,11 @@ class Localized:
 
         get_message(message_key: str, current_lang: str):
             Returns a message string based on the current language setting.
+
+        get_task_card(task: tuple, current_lang: str):
+            Returns the task card rendered for the current language.
+
+    Keyboards and messages are compiled into read-only lookup tables once, in the constructor.
     """
     def __init__(self):
         self.buttons = {
@@ -93,11 +100,27 @@ class Localized:
                 "wrong_count_ticket": "❌Проверьте правильность кол-во тикетов и введите его заново",
                 "unloading_wait": "⏱Выгрузка. Пожалуйста подождите.....",
                 "success_unloading": "Выгрузка обновлена✅",
-                "send_login": "Отправь мне список логинов в формате:\ntest\ntest2\ntest3",
+                "unloading_report": "Принято: {accepted}\nОтклонено: {rejected}\nДубликаты: {duplicated}\n"
+                                    "Добавлено: {inserted}\nИзменено: {updated}\nУдалено: {deleted}\n"
+                                    "Уже выданы сегодня: {claimed}",
+                "send_login": "Отправь мне список логинов в формате:\ntest\ntest2 2\ntest3 0\n"
+                              "Без уровня ставится приоритет 1, 0 снимает приоритет, * 0 снимает его у всех задач",
                 "result_prior": "Результаты обновления приоритета:",
                 "update_db": "База данных обновлена✅",
                 "update_db_root": "База данных Администраторов обновлена✅",
+                "reconcile_report": "Добавлено: {added}\nУдалено: {removed}\nИзменено: {changed}\n"
+                                    "Отклонено: {rejected}\nДубликаты: {duplicated}",
                 "get_oc": "забрал ОС✅",
+                "task_card": "Статус : {0}\n"
+                             "Дата начала оценки : {1}\n"
+                             "Логин : {2}\n"
+                             "Ссылка на оценку: <a href=\"{3}\">{2}</a>\n"
+                             "Примечание : {4}\n"
+                             "Группа 2.0 : {5}\n"
+                             "Выработка : {7}\n"
+                             "Оценено : {8}\n"
+                             "Автопроверки : {9}\n"
+                             "Остаток : {10}",
                 "wrong_add_task": "Ошибка! Отчет не соответствует требованиям",
                 "wrong_date_task": "Ошибка! Неверный формат даты. Необходимо указать дату в 4 строке."
             },
@@ -120,45 +143,73 @@ class Localized:
                 "wrong_count_ticket": "❌Check the correctness of the ticket count and enter it again",
                 "unloading_wait": "⏱Unloading. Please wait.....",
                 "success_unloading": "Unloading updated✅",
-                "send_login": "Send me a list of logins in the format:\ntest\ntest2\ntest3",
+                "unloading_report": "Accepted: {accepted}\nRejected: {rejected}\nDuplicates: {duplicated}\n"
+                                    "Added: {inserted}\nChanged: {updated}\nDeleted: {deleted}\n"
+                                    "Already handed out today: {claimed}",
+                "send_login": "Send me a list of logins in the format:\ntest\ntest2 2\ntest3 0\n"
+                              "Without a level the priority is 1, 0 clears it, * 0 clears it for all tasks",
                 "result_prior": "Priority update results:",
                 "update_db": "Database updated✅",
                 "update_db_root": "Administrators database updated✅",
+                "reconcile_report": "Added: {added}\nRemoved: {removed}\nChanged: {changed}\n"
+                                    "Rejected: {rejected}\nDuplicates: {duplicated}",
                 "get_oc": "picked up OC✅",
+                "task_card": "Status : {0}\n"
+                             "Date of assessment : {1}\n"
+                             "Login : {2}\n"
+                             "Evaluation link: <a href=\"{3}\">{2}</a>\n"
+                             "Note : {4}\n"
+                             "Group 2.0 : {5}\n"
+                             "Productivity : {7}\n"
+                             "Assessed : {8}\n"
+                             "Autotests : {9}\n"
+                             "Remaining : {10}",
                 "wrong_add_task": "Error! Report does not meet requirements",
                 "wrong_date_task": "Error! Incorrect date format. Please specify the date in the 4th line."
             }
         }
 
-    def get_keyboard(self, keyboard_key: str, current_lang: str):
+        self._keyboards = MappingProxyType({(lang, key): self._build_keyboard(key, lang)
+                                            for lang, buttons in self.buttons.items() for key in buttons})
+        self._messages = MappingProxyType({(lang, key): message
+                                           for lang, messages in self.messages.items()
+                                           for key, message in messages.items()})
+
+    def _build_keyboard(self, keyboard_key: str, lang_code: str):
         """
-        Get keyboard object based on the current language setting
+        Builds the keyboard object of the language
         """
-        lang_code = current_lang
-        if lang_code in self.buttons and keyboard_key in self.buttons[lang_code]:
-            if keyboard_key == "admin_button":
-                keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-                admin_buttons = self.buttons[lang_code][keyboard_key]
-                keyboard.add(admin_buttons[0]).insert(admin_buttons[1])
-                keyboard.add(admin_buttons[2]).insert(admin_buttons[3])
-                keyboard.add(admin_buttons[4]).add(admin_buttons[5]).add(admin_buttons[6])
-            elif keyboard_key == "button_change":
-                keyboard = InlineKeyboardMarkup(row_width=4)
-                keyboard.add(*self.buttons[lang_code][keyboard_key])
-            else:
-                keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-                keyboard.add(*self.buttons[lang_code][keyboard_key])
+        if keyboard_key == "admin_button":
+            keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+            admin_buttons = self.buttons[lang_code][keyboard_key]
+            keyboard.add(admin_buttons[0]).insert(admin_buttons[1])
+            keyboard.add(admin_buttons[2]).insert(admin_buttons[3])
+            keyboard.add(admin_buttons[4]).add(admin_buttons[5]).add(admin_buttons[6])
+        elif keyboard_key == "button_change":
+            keyboard = InlineKeyboardMarkup(row_width=4)
+            keyboard.add(*self.buttons[lang_code][keyboard_key])
         else:
-            keyboard = None
-
+            keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+            keyboard.add(*self.buttons[lang_code][keyboard_key])
         return keyboard
 
+    def get_keyboard(self, keyboard_key: str, current_lang: str):
+        """
+        Get keyboard object based on the current language setting.
+        The keyboards are built once and shared, so they must not be changed
+        """
+        return self._keyboards.get((current_lang, keyboard_key))
+
     def get_message(self, message_key: str, current_lang: str):
         """
         Get message object based on the current language setting
         """
-        lang_code = current_lang
-        if lang_code in self.messages and message_key in self.messages[lang_code]:
-            return self.messages[lang_code][message_key]
+        return self._messages.get((current_lang, message_key), "Empty message")
 
-        return "Empty message"
+    def get_task_card(self, task: tuple, current_lang: str):
+        """
+        Renders the task card of the language
+        :param task: row of the task table
+        :param current_lang: language of the user
+        """
+        return self.get_message("task_card", current_lang).format(*task)
@@ -8,6 +8,11 @@ from user import User
 from admin import Admin
 from bot_tg import BotTelegram
 from localized import Localized
+from identity import IdentityCache
+from pool import ConnectionPool
+from outbox import Outbox
+from rotation import SkillRotation
+from task_queue import TaskQueue
 
 
 def check_folders(folders: list):
@@ -49,21 +54,45 @@ def main():
                     'admin_sheet_name': os.environ['ADMIN_SHEET_NAME'],
                     'addition_sheet_name': os.environ['ADDITION_SHEET_NAME'],
                     'addition_begin_column': os.environ['ADDITION_BEGIN_COLUMN'],
-                    'head_task': os.environ['HEAD_TASK']}
+                    'head_task': os.environ['HEAD_TASK'],
+                    'worksheet_ttl': float(os.environ.get('WORKSHEET_TTL', 3600)),
+                    'append_delay': float(os.environ.get('APPEND_DELAY', 300)) / 1000,
+                    'append_batch_size': int(os.environ.get('APPEND_BATCH_SIZE', 100)),
+                    'chunk_rows': int(os.environ.get('SHEET_CHUNK_ROWS', 5000)),
+                    'snapshot_ttl': float(os.environ.get('SNAPSHOT_TTL', 10)),
+                    'quota_rate': float(os.environ.get('SHEETS_QUOTA', 60)),
+                    'quota_burst': int(os.environ.get('SHEETS_BURST', 5)),
+                    'write_attempts': int(os.environ.get('SHEET_WRITE_ATTEMPTS', 3))}
 
-    db_config = {'db': os.environ['DB_PATH']}
+    db_config = {'db': os.environ['DB_PATH'],
+                 'pool_size': int(os.environ.get('DB_POOL_SIZE', 4)),
+                 'counter_flush_interval': float(os.environ.get('COUNTER_FLUSH_INTERVAL', 5))}
 
     bot_config = {'token_bot': os.environ['TOKEN_TELEGRAM'],
                   'superusers': os.environ['SUPERUSER'],
                   'feedback_id': os.environ['FEEDBACK_ID'],
                   'additional_id': os.environ['ADDITIONAL_ID'],
-                  'db': os.environ['DB_PATH']}
+                  'db': os.environ['DB_PATH'],
+                  'fsm_cache_size': int(os.environ.get('FSM_CACHE_SIZE', 0)),
+                  'fsm_flush_interval': float(os.environ.get('FSM_FLUSH_INTERVAL', 5)),
+                  'fsm_group_commit': os.environ.get('FSM_GROUP_COMMIT', '0') == '1',
+                  'fsm_commit_delay': float(os.environ.get('FSM_COMMIT_DELAY', 5)) / 1000,
+                  'fsm_ttl': float(os.environ.get('FSM_TTL', 24)),
+                  'task_sync_interval': int(os.environ.get('TASK_SYNC_INTERVAL', 0)),
+                  'outbox_interval': float(os.environ.get('OUTBOX_INTERVAL', 5))}
 
     gs = google_sheet.SheetGoogle(sheet_config)
-    db_admin = Admin(db_config)
-    db_user = User(db_config)
+    # the same pragmas the storage set on its own connection before it used the pool
+    pool = ConnectionPool(db_config['db'], size=db_config['pool_size'],
+                          synchronous='NORMAL' if bot_config['fsm_group_commit'] else None)
+    task_queue = TaskQueue(pool)
+    rotation = SkillRotation(pool, flush_interval=db_config['counter_flush_interval'])
+    identity = IdentityCache(pool, superusers=bot_config['superusers'].split(','))
+    db_admin = Admin(db_config, pool, task_queue, rotation, identity)
+    db_user = User(db_config, pool, task_queue, rotation, identity)
     localized = Localized()
-    bot_tg = BotTelegram(bot_config, gs, db_admin, db_user, localized)
+    outbox = Outbox(pool, gs, interval=bot_config['outbox_interval'])
+    bot_tg = BotTelegram(bot_config, gs, db_admin, db_user, localized, pool, outbox)
     bot_tg.run()
 
 
@@ -0,0 +1,202 @@
+import asyncio
+import contextlib
+import json
+import logging
+import time
+import uuid
+from datetime import date
+from typing import Dict, Optional
+
+from google_sheet import SheetGoogle
+from pool import ConnectionPool
+
+# methods of SheetGoogle that may be called through the outbox
+METHODS = ('spreadsheet_entry', 'addition_task_entry')
+
+
+class Outbox:
+    """
+    Sheet writes stored in the outbox table and sent to Google by a background worker.
+
+    put() only inserts a row, so the Telegram flow does not wait for Google. The worker calls
+    the SheetGoogle method of every due row; concurrent calls are appended together by SheetGoogle.
+    A failed row is retried after interval * 2 ** attempts seconds, at most max_backoff;
+    SheetGoogle gives up on a write after a few attempts, so an outage ends up here.
+    The key makes put() idempotent: a write with a key already in the outbox is not stored again.
+    Sent rows keep their key and the cell written by the method for keep_sent seconds.
+    change_number_tickets() corrects a result still waiting in the outbox, a sent one in its stored cell,
+    and looks for the result in the sheet only when neither is known.
+    """
+
+    def __init__(self, pool: ConnectionPool, gs: SheetGoogle, interval: float = 5.0,
+                 max_backoff: float = 600.0, batch_size: int = 200, keep_sent: float = 86400.0,
+                 close_timeout: float = 10.0):
+        self.pool = pool
+        self.gs = gs
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        self.keep_sent = keep_sent
+        self.close_timeout = close_timeout
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        # id -> round of send_pending that took the row, the lock keeps corrections from changing taken rows
+        self._sending: Dict[int, asyncio.Future] = {}
+        self._select_lock = asyncio.Lock()
+        self._stats = {'sent': 0, 'failed': 0, 'corrected': 0}
+
+    async def put(self, method: str, kwargs: Dict, key: Optional[str] = None):
+        """
+        Stores a sheet write
+        :param method: name of the SheetGoogle method
+        :param kwargs: arguments of the method
+        :param key: idempotency key, a random one by default
+        """
+        if method not in METHODS:
+            raise ValueError(f'Unknown sheet method: {method}')
+        async with self.pool.acquire() as cursor:
+            await cursor.execute("""
+                INSERT OR IGNORE INTO outbox (key, method, kwargs, attempts, next_try, created)
+                VALUES (?, ?, ?, 0, ?, ?)
+            """, (key or uuid.uuid4().hex, method, json.dumps(kwargs, ensure_ascii=False), 0, time.time()))
+            await cursor.commit()
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        """
+        Starts the worker, the rows left by the previous run are sent too
+        """
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                await self.send_pending()
+            except Exception as e:
+                logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, method: str, kwargs: str):
+        return await getattr(self.gs, method)(**json.loads(kwargs))
+
+    async def send_pending(self) -> int:
+        """
+        Sends the due rows of the outbox
+        :return: number of sent rows
+        """
+        now = time.time()
+        async with self._select_lock:
+            async with self.pool.reader() as cursor:
+                rows = await cursor.execute_fetchall("""
+                    SELECT id, method, kwargs, attempts FROM outbox
+                    WHERE sent IS NULL AND next_try <= ? ORDER BY id LIMIT ?
+                """, (now, self.batch_size))
+            # rows taken by a round that is still running are not sent twice
+            rows = [row for row in rows if row[0] not in self._sending]
+            if not rows:
+                return 0
+            done = asyncio.get_running_loop().create_future()
+            self._sending.update((id_row, done) for id_row, _, _, _ in rows)
+        try:
+            results = await asyncio.gather(*(self._send(method, kwargs) for _, method, kwargs, _ in rows),
+                                           return_exceptions=True)
+            sent = []
+            failed = []
+            for (id_row, _, _, attempts), result in zip(rows, results):
+                if isinstance(result, Exception):
+                    delay = min(self.interval * 2 ** attempts, self.max_backoff)
+                    failed.append((now + delay, f'{result.__class__.__name__} - {result}', id_row))
+                else:
+                    sent.append((now, json.dumps(result) if result else None, id_row))
+            async with self.pool.acquire() as cursor:
+                await cursor.executemany("UPDATE outbox SET sent = ?, error = NULL, cell = ? WHERE id = ?", sent)
+                await cursor.execute("DELETE FROM outbox WHERE sent < ?", (now - self.keep_sent,))
+                await cursor.executemany(
+                    "UPDATE outbox SET attempts = attempts + 1, next_try = ?, error = ? WHERE id = ?", failed)
+                await cursor.commit()
+        finally:
+            for id_row, _, _, _ in rows:
+                self._sending.pop(id_row, None)
+            done.set_result(None)
+        self._stats['sent'] += len(sent)
+        self._stats['failed'] += len(failed)
+        if failed:
+            logging.warning(f"{len(failed)} sheet writes failed and will be retried")
+        return len(sent)
+
+    async def change_number_tickets(self, support_login: str, telegram_id: str, value) -> str:
+        """
+        Changes the number of tickets of today's result of the user for the support login.
+        A result that was not sent yet is changed in the outbox, a sent one in the sheet at the cell
+        stored when it was sent, so the row is found after a restart too
+        :param support_login: support login from the message
+        :param telegram_id: user id telegram
+        :param value: ticket quantity
+        :return: 'Successful', 'Not found' or 'Error' like SheetGoogle.change_number_tickets
+        """
+        cell = None
+        for _ in range(2):
+            async with self._select_lock:
+                async with self.pool.acquire() as cursor:
+                    rows = await cursor.execute_fetchall("""
+                        SELECT id, sent, cell FROM outbox
+                        WHERE method = 'spreadsheet_entry'
+                        AND json_extract(kwargs, '$.login_support') = ?
+                        AND json_extract(kwargs, '$.id_telegram') = ?
+                        AND json_extract(kwargs, '$.date') = ?
+                        ORDER BY id DESC LIMIT 1
+                    """, (support_login, int(telegram_id), date.today().strftime('%d.%m.%y')))
+                    if not rows:
+                        break
+                    if rows[0][1] is not None:
+                        cell = json.loads(rows[0][2]) if rows[0][2] else None
+                        break
+                    done = self._sending.get(rows[0][0])
+                    if done is None:
+                        await cursor.execute(
+                            "UPDATE outbox SET kwargs = json_set(kwargs, '$.quantity_viewed_ticket', ?) WHERE id = ?",
+                            (int(value), rows[0][0]))
+                        await cursor.commit()
+                        self._stats['corrected'] += 1
+                        return 'Successful'
+            # the row is being sent, after the round it is either in the sheet or waiting again
+            await done
+        return await self.gs.change_number_tickets(support_login, telegram_id, value, cell=cell)
+
+    async def stats(self) -> Dict:
+        """
+        :return: numbers of sent, failed and corrected writes, of waiting rows and the age of the oldest one in seconds
+        """
+        async with self.pool.reader() as cursor:
+            rows = await cursor.execute_fetchall(
+                "SELECT count(*), min(created), max(attempts) FROM outbox WHERE sent IS NULL")
+        pending, oldest, attempts = rows[0]
+        return {**self._stats, 'pending': pending, 'max_attempts': attempts or 0,
+                'oldest_s': round(time.time() - oldest, 1) if oldest else 0}
+
+    async def close(self):
+        """
+        Stops the worker after the current round. A round still running after close_timeout seconds
+        is cancelled; unsent rows stay in the outbox for the next start
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.close_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("The outbox round was cancelled on close, its rows will be sent after the restart")
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        self._task = None
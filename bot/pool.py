@@ -0,0 +1,170 @@
+import asyncio
+import contextlib
+import logging
+import sqlite3
+import time
+from typing import AsyncIterator, Dict, Optional
+
+import aiosqlite
+
+
+class ConnectionPool:
+    """
+    Pool of long-lived aiosqlite connections shared by Admin, User and SQLiteStorage.
+
+    Writes go through acquire(), which hands out one of `size` connections exclusively.
+    Reads that do not need a transaction go through reader(), a separate read-only connection.
+    Connections that were idle longer than health_check_interval seconds are checked
+    before use and reopened if they stopped working.
+    The database is always in WAL mode so that the reader does not block the writers;
+    synchronous, if given, is set on every write connection (e.g. 'NORMAL' for group commit).
+
+    Usage:
+
+    pool = ConnectionPool('db/database.db', size=4)
+    async with pool.acquire() as db:
+        await db.execute(...)
+        await db.commit()
+    await pool.close()
+    """
+
+    def __init__(self, db_path: str, size: int = 4, health_check_interval: float = 60.0,
+                 synchronous: Optional[str] = None):
+        self.db = db_path
+        self.size = size
+        self.synchronous = synchronous
+        self.health_check_interval = health_check_interval
+        self._idle: Optional[asyncio.Queue] = None
+        self._connections = []
+        self._reader: Optional[aiosqlite.Connection] = None
+        self._reader_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._last_used: Dict[int, float] = {}
+        self._stats = {'acquired': 0, 'wait_time': 0.0, 'max_wait': 0.0,
+                       'query_time': 0.0, 'max_query': 0.0, 'reconnects': 0}
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        if read_only:
+            db = await aiosqlite.connect(f'file:{self.db}?mode=ro', uri=True)
+        else:
+            db = await aiosqlite.connect(self.db)
+            await db.execute("PRAGMA journal_mode=WAL")
+            if self.synchronous:
+                await db.execute(f"PRAGMA synchronous={self.synchronous}")
+        await db.execute("PRAGMA busy_timeout=5000")
+        self._last_used[id(db)] = time.monotonic()
+        return db
+
+    async def _healthy(self, db: aiosqlite.Connection, read_only: bool = False) -> aiosqlite.Connection:
+        """
+        Returns the connection if it still works, otherwise a new one
+        """
+        if time.monotonic() - self._last_used.get(id(db), 0) < self.health_check_interval:
+            return db
+        try:
+            await db.execute_fetchall("SELECT 1")
+            self._last_used[id(db)] = time.monotonic()
+            return db
+        except (sqlite3.Error, ValueError) as e:
+            logging.warning(f"Reconnecting to the database: {e.__class__.__name__} - {e}")
+            self._stats['reconnects'] += 1
+            self._last_used.pop(id(db), None)
+            with contextlib.suppress(Exception):
+                await db.close()
+            new_db = await self._connect(read_only)
+            if not read_only:
+                self._connections[self._connections.index(db)] = new_db
+            return new_db
+
+    async def _get_idle(self) -> asyncio.Queue:
+        if self._idle is not None:
+            return self._idle
+        async with self._open_lock:
+            if self._idle is None:
+                idle = asyncio.Queue()
+                for _ in range(self.size):
+                    db = await self._connect()
+                    self._connections.append(db)
+                    idle.put_nowait(db)
+                self._idle = idle
+        return self._idle
+
+    def _record(self, wait: float, query: float):
+        stats = self._stats
+        stats['acquired'] += 1
+        stats['wait_time'] += wait
+        stats['max_wait'] = max(stats['max_wait'], wait)
+        stats['query_time'] += query
+        stats['max_query'] = max(stats['max_query'], query)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Takes a connection for exclusive use. Uncommitted changes are rolled back when it is returned
+        """
+        idle = await self._get_idle()
+        started = time.perf_counter()
+        db = await idle.get()
+        acquired = time.perf_counter()
+        try:
+            db = await self._healthy(db)
+            yield db
+        finally:
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            except (sqlite3.Error, ValueError):
+                pass
+            self._last_used[id(db)] = time.monotonic()
+            idle.put_nowait(db)
+            self._record(acquired - started, time.perf_counter() - acquired)
+
+    @contextlib.asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Returns the shared read-only connection
+        """
+        started = time.perf_counter()
+        async with self._reader_lock:
+            if self._reader is None:
+                self._reader = await self._connect(read_only=True)
+            else:
+                self._reader = await self._healthy(self._reader, read_only=True)
+        acquired = time.perf_counter()
+        try:
+            yield self._reader
+        finally:
+            self._last_used[id(self._reader)] = time.monotonic()
+            self._record(acquired - started, time.perf_counter() - acquired)
+
+    def stats(self) -> Dict:
+        """
+        Pool statistics
+        :return: number of acquisitions, wait and query times in milliseconds
+        """
+        stats = self._stats
+        acquired = stats['acquired'] or 1
+        return {'size': self.size,
+                'idle': self._idle.qsize() if self._idle is not None else self.size,
+                'acquired': stats['acquired'],
+                'avg_wait_ms': round(stats['wait_time'] / acquired * 1000, 2),
+                'max_wait_ms': round(stats['max_wait'] * 1000, 2),
+                'avg_query_ms': round(stats['query_time'] / acquired * 1000, 2),
+                'max_query_ms': round(stats['max_query'] * 1000, 2),
+                'reconnects': stats['reconnects']}
+
+    async def close(self):
+        """
+        Closes all connections of the pool
+        """
+        for db in self._connections:
+            with contextlib.suppress(Exception):
+                await db.close()
+        if self._reader is not None:
+            with contextlib.suppress(Exception):
+                await self._reader.close()
+        self._connections = []
+        self._reader = None
+        self._idle = None
+        self._last_used.clear()
+        logging.info('Database pool stats: %s', self.stats())
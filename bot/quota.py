@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from gspread.exceptions import APIError
+from gspread_asyncio import AsyncioGspreadClientManager
+
+# priority lanes, a lower number is served first
+RESULTS = 0
+READS = 1
+SYNC = 2
+LANES = {RESULTS: 'results', READS: 'reads', SYNC: 'sync'}
+
+_lane: ContextVar[int] = ContextVar('sheet_lane', default=READS)
+# attempts of a call before its error is raised, None retries until it succeeds
+_attempts: ContextVar[Optional[int]] = ContextVar('sheet_attempts', default=None)
+
+
+class QuotaClientManager(AsyncioGspreadClientManager):
+    """
+    Client manager that spends the Google Sheets quota through a token bucket.
+
+    Every API call takes a token; the bucket holds up to `burst` tokens and is refilled at
+    `rate` tokens per minute. Waiting calls get tokens by lane: results of the auditors first,
+    then admin reads, then synchronizations. Failed calls are retried here rather than in the
+    base manager, so every attempt takes a token in its lane: a 429 response pauses all lanes
+    with an exponential backoff, server and connection errors are retried after gspread_delay.
+    Calls made inside attempts(n) raise their last error after n attempts instead of retrying forever.
+
+    Usage:
+
+    agcm = QuotaClientManager(get_creds, rate=60, burst=5)
+    with agcm.lane(RESULTS):
+        await worksheet.append_rows(rows)
+    """
+
+    def __init__(self, credentials_fn, rate: float = 60, burst: int = 5, max_backoff: float = 64.0, **kwargs):
+        super().__init__(credentials_fn, **kwargs)
+        self.rate = rate / 60
+        self.burst = burst
+        self.max_backoff = max_backoff
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._throttled = 0
+        self._waiters: List[list] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {lane: {'calls': 0, 'wait_time': 0.0, 'max_wait': 0.0} for lane in LANES}
+        self._stats_429 = 0
+
+    @staticmethod
+    @contextlib.contextmanager
+    def lane(lane: int) -> Iterator[None]:
+        """
+        Sets the lane of the calls made inside the block
+        """
+        token = _lane.set(lane)
+        try:
+            yield
+        finally:
+            _lane.reset(token)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def attempts(attempts: int) -> Iterator[None]:
+        """
+        Limits the attempts of the calls made inside the block
+        """
+        token = _attempts.set(attempts)
+        try:
+            yield
+        finally:
+            _attempts.reset(token)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    async def _dispatch(self):
+        while self._waiters:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            # a cancelled call does not take a token
+            if not future.done():
+                self._tokens -= 1
+                future.set_result(None)
+        self._dispatcher = None
+
+    async def _acquire(self, lane: int):
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [lane, next(self._sequence), future])
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        wait = time.monotonic() - started
+        stats = self._stats[lane]
+        stats['calls'] += 1
+        stats['wait_time'] += wait
+        stats['max_wait'] = max(stats['max_wait'], wait)
+
+    async def _call(self, method, *args, **kwargs):
+        api_call_count = kwargs.pop('api_call_count', 1)
+        lane = _lane.get()
+        attempts = _attempts.get()
+        for attempt in itertools.count(1):
+            for _ in range(api_call_count):
+                await self._acquire(lane)
+            try:
+                result = await super()._call(method, *args, **kwargs)
+            except APIError as e:
+                code = e.response.status_code
+                if 400 <= code <= 499 and code != 429:
+                    raise
+                if code == 429:
+                    self._throttle(method)
+                else:
+                    logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+                if attempts is not None and attempt >= attempts:
+                    raise
+                if code != 429:
+                    await asyncio.sleep(self.gspread_delay)
+            except requests.RequestException as e:
+                logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+                if attempts is not None and attempt >= attempts:
+                    raise
+                await asyncio.sleep(self.gspread_delay)
+            else:
+                self._throttled = 0
+                return result
+
+    async def delay(self):
+        # the token bucket spaces the calls instead of the fixed gspread_delay
+        return
+
+    async def handle_gspread_error(self, e, method, args, kwargs):
+        # the base manager would retry while holding its lock, _call retries with a new token
+        raise e
+
+    async def handle_requests_error(self, e, method, args, kwargs):
+        raise e
+
+    def _throttle(self, method):
+        """
+        Pauses all lanes after a 429 response, the retry waits for the pause like any other call
+        """
+        self._stats_429 += 1
+        backoff = min(self.max_backoff, 2 ** self._throttled) * random.uniform(0.5, 1)
+        self._throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+        self._tokens = 0
+        logging.warning(f"Google Sheets quota exceeded calling {method.__name__}, retrying in {backoff:.1f} s")
+
+    def stats(self) -> Dict:
+        """
+        :return: queue depth and wait times of the lanes in milliseconds, tokens and number of 429 responses
+        """
+        depth = {lane: 0 for lane in LANES}
+        for lane, _, future in self._waiters:
+            if not future.done():
+                depth[lane] += 1
+        result = {'tokens': round(min(self.burst, self._tokens + (time.monotonic() - self._refilled) * self.rate), 2),
+                  'responses_429': self._stats_429}
+        for lane, name in LANES.items():
+            stats = self._stats[lane]
+            result[f'{name}_queued'] = depth[lane]
+            result[f'{name}_calls'] = stats['calls']
+            result[f'{name}_avg_wait_ms'] = round(stats['wait_time'] / (stats['calls'] or 1) * 1000, 1)
+            result[f'{name}_max_wait_ms'] = round(stats['max_wait'] * 1000, 1)
+        return result
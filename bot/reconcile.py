@@ -0,0 +1,141 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+from pydantic import BaseModel, ValidationError
+
+
+class Diff:
+    """
+    Difference between the rows of a sheet and a table, keyed by the key column.
+
+    Attributes:
+        added (dict): key -> values of the rows missing in the table.
+        removed (list): keys of the table missing in the sheet.
+        changed (dict): key -> new values of the rows that differ.
+        rejected (int): number of rows that did not pass validation.
+        duplicated (int): number of rows whose key was already seen in the sheet.
+    """
+
+    def __init__(self):
+        self.added: Dict = {}
+        self.removed: List = []
+        self.changed: Dict = {}
+        self.rejected = 0
+        self.duplicated = 0
+
+    def summary(self) -> Dict[str, int]:
+        return {'added': len(self.added), 'removed': len(self.removed), 'changed': len(self.changed),
+                'rejected': self.rejected, 'duplicated': self.duplicated}
+
+
+class Reconciler:
+    """
+    Synchronizes a table with the rows of a sheet in one transaction.
+
+    Sheet rows are validated with the model, both sides are put in dicts keyed by the key column
+    and compared in linear time; the difference is applied with one executemany per kind of change.
+
+    Usage:
+
+    reconciler = Reconciler('admin', 'id', ('login', 'id'), AdminCreate)
+    async with pool.acquire() as db:
+        diff = await reconciler.apply(db, rows)
+    """
+
+    def __init__(self, table: str, key: str, columns: Tuple[str, ...], model: type[BaseModel],
+                 defaults: Optional[Dict[str, object]] = None):
+        """
+        :param table: table name
+        :param key: column identifying a row
+        :param columns: columns taken from the validated sheet rows, the others are left as they are
+        :param model: model with from_list validating a sheet row
+        :param defaults: values of the other columns for the inserted rows
+        """
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.model = model
+        self.defaults = defaults or {}
+        self._values = tuple(i for i in columns if i != key)
+
+    def keyed(self, rows: Iterable[list], diff: Diff) -> Dict:
+        """
+        Validates the sheet rows, the first row of a duplicated key wins
+        :param rows: rows of the sheet
+        :param diff: counts the rejected and duplicated rows
+        :return: key -> values of the other columns
+        """
+        result = {}
+        for row in rows:
+            try:
+                item = self.model.from_list(row).model_dump()
+            except (ValidationError, ValueError, IndexError):
+                logging.warning(f'There was a problem with {row}')
+                diff.rejected += 1
+                continue
+            key = item[self.key]
+            if key in result:
+                logging.warning(f"This {self.key}: {key} is duplicated in the google table.")
+                diff.duplicated += 1
+                continue
+            result[key] = tuple(item[i] for i in self._values)
+        return result
+
+    async def current(self, db: aiosqlite.Connection) -> Dict:
+        """
+        :return: key -> values of the other columns of the table
+        """
+        rows = await db.execute_fetchall(
+            f"SELECT {self.key}, {', '.join(self._values)} FROM {self.table}")
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def diff(self, current: Dict, desired: Dict, diff: Diff, add: bool = True, remove: bool = True) -> Diff:
+        """
+        Computes the add, remove and change sets
+        :param current: rows of the table
+        :param desired: rows of the sheet
+        :param diff: diff to fill
+        :param add: whether keys missing in the table are added
+        :param remove: whether keys missing in the sheet are removed
+        """
+        for key, values in desired.items():
+            old = current.get(key)
+            if old is None:
+                if add:
+                    diff.added[key] = values
+            elif old != values:
+                diff.changed[key] = values
+        if remove:
+            diff.removed = [key for key in current if key not in desired]
+        return diff
+
+    async def apply(self, db: aiosqlite.Connection, rows: Iterable[list],
+                    add: bool = True, remove: bool = True) -> Diff:
+        """
+        Applies the rows of the sheet to the table and commits
+        :param db: connection
+        :param rows: rows of the sheet
+        :param add: whether keys missing in the table are added
+        :param remove: whether keys missing in the sheet are removed
+        :return: applied difference
+        """
+        diff = Diff()
+        desired = self.keyed(rows, diff)
+        self.diff(await self.current(db), desired, diff, add, remove)
+
+        if diff.removed:
+            await db.executemany(f"DELETE FROM {self.table} WHERE {self.key} = ?",
+                                 [(key,) for key in diff.removed])
+        if diff.changed:
+            await db.executemany(
+                f"UPDATE {self.table} SET {', '.join(f'{i} = ?' for i in self._values)} WHERE {self.key} = ?",
+                [(*values, key) for key, values in diff.changed.items()])
+        if diff.added:
+            columns = (self.key, *self._values, *self.defaults)
+            await db.executemany(
+                f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [(key, *values, *self.defaults.values()) for key, values in diff.added.items()])
+        await db.commit()
+        logging.info(f"Synchronization of the {self.table} table: {diff.summary()}")
+        return diff
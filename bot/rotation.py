@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pool import ConnectionPool
+
+
+class SkillRotation:
+    """
+    In-process cache of the user skill lists and of their rotation counters.
+
+    A user row is read once; after that the skill is chosen without I/O. Changed counters
+    are written back to the num column every flush_interval seconds and on close().
+    Admin invalidates the skill lists after the user table is synchronized.
+    """
+
+    def __init__(self, pool: ConnectionPool, flush_interval: float = 5.0):
+        self.pool = pool
+        self._flush_interval = flush_interval
+        self._skills: Dict[int, List[str]] = {}
+        self._counters: Dict[int, int] = {}
+        self._dirty: Dict[int, int] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def _load(self, id_telegram: int) -> Optional[List[str]]:
+        async with self.pool.reader() as cursor:
+            cursor_object = await cursor.execute("SELECT skill, num FROM user WHERE id = ?", (id_telegram,))
+            result = await cursor_object.fetchone()
+            await cursor_object.close()
+        if not result:
+            logging.warning('User %s was not found and no active skills', id_telegram)
+            return None
+        skills = [i.strip() for i in result[0].split(',')]
+        self._skills[id_telegram] = skills
+        # a counter changed by this process is newer than the one in the database
+        self._counters.setdefault(id_telegram, int(result[1] or 0))
+        return skills
+
+    async def next_skill(self, id_telegram: int, available: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        Increments the counter of the user or zeroes it after the last skill.
+        Skills for which available returns False are skipped unless all of them are
+        :param id_telegram: user id telegram
+        :param available: whether the skill has tasks
+        :return: skill that will be used or None if the user was not found
+        """
+        skills = self._skills.get(id_telegram) or await self._load(id_telegram)
+        if not skills:
+            return None
+        counter = self._counters[id_telegram]
+        if len(skills) - 1 > counter:
+            counter += 1
+        else:
+            counter = 0
+        if available is not None:
+            for step in range(len(skills)):
+                index = (counter + step) % len(skills)
+                if available(skills[index]):
+                    counter = index
+                    break
+        self._counters[id_telegram] = counter
+        self._dirty[id_telegram] = counter
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        return skills[counter]
+
+    def invalidate(self, removed: Iterable[int] = ()):
+        """
+        Drops the cached skill lists, they are read again on the next request
+        :param removed: ids deleted from the user table, their counters are dropped too
+        """
+        self._skills.clear()
+        for id_telegram in removed:
+            self._counters.pop(id_telegram, None)
+            self._dirty.pop(id_telegram, None)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+
+    async def flush(self):
+        """
+        Writes the changed counters to the database in one transaction
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            async with self.pool.acquire() as cursor:
+                await cursor.executemany("UPDATE user SET num = ? WHERE id = ?",
+                                         [(counter, id_telegram) for id_telegram, counter in dirty.items()])
+                await cursor.commit()
+        except Exception:
+            # counters changed meanwhile are newer than the ones that failed
+            for id_telegram, counter in dirty.items():
+                self._dirty.setdefault(id_telegram, counter)
+            raise
+
+    async def close(self):
+        """
+        Stops the flush loop and writes the pending counters
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
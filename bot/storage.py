@@ -1,9 +1,32 @@
-from typing import Union, Dict, Optional, List, Tuple, AnyStr
+import asyncio
+import contextlib
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Union, Dict, Optional, List, Tuple, AnyStr, AsyncIterator
 
 import aiosqlite
-import jsonpickle
 from aiogram.dispatcher.storage import BaseStorage
 
+import codec
+from pool import ConnectionPool
+
+_UNSET = object()
+
+
+class _CacheEntry:
+    """
+    Cached FSM state and data of one (chat, user) pair
+    """
+    __slots__ = ('state', 'data', 'dirty')
+
+    def __init__(self):
+        self.state = _UNSET
+        self.data = _UNSET
+        self.dirty = set()
+
 
 class SQLiteStorage(BaseStorage):
     """
@@ -13,124 +36,509 @@ class SQLiteStorage(BaseStorage):
 
     storage = SQLiteStorage(db_path='data/database.db')
     dp = Dispatcher(bot, storage=storage)
+
+    With cache_size > 0 states and data are kept in an LRU cache and
+    changes are written to the database every flush_interval seconds and on close().
+
+    With group_commit=True the database is switched to WAL mode and all writes go
+    through one writer coroutine that commits the writes collected during commit_delay
+    seconds in a single transaction.
+
+    Data and buckets are encoded with the given codec (codec.JsonCodec by default),
+    rows written by other codecs are still read.
+
+    Every state and data row keeps the time it was last written,
+    sweep_expired() deletes the rows that were not touched for the given time.
+
+    If a ConnectionPool is given, the storage uses its connections instead of opening its own;
+    the journal mode and synchronous pragmas are then the ones of the pool.
     """
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, cache_size: int = 0, flush_interval: float = 5.0,
+                 group_commit: bool = False, commit_delay: float = 0.005, data_codec=None,
+                 pool: Optional[ConnectionPool] = None):
         self._path_db = db_path
         self._db = None
+        self._pool = pool
+        self._schema_ready = False
+        # concurrent first writes must not upgrade the schema twice
+        self._schema_lock = asyncio.Lock()
+        self._codec = data_codec or codec.JsonCodec()
+        # the storage codec is known by its version byte even if it is not one of the built-in codecs
+        self._codecs = {**codec.CODECS, self._codec.version: self._codec}
+        self._group_commit = group_commit
+        self._commit_delay = commit_delay
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._write_stats = {'batches': 0, 'writes': 0, 'max_batch_size': 0,
+                             'commit_time': 0.0, 'last_commit_latency': 0.0}
+        self._cache_size = cache_size
+        self._flush_interval = flush_interval
+        self._cache: OrderedDict[Tuple[int, int], _CacheEntry] = OrderedDict()
+        self._dirty: Dict[Tuple[int, int], _CacheEntry] = {}
+        self._flush_task: Optional[asyncio.Task] = None
 
     async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        if self._writer_task is not None:
+            await self._write_queue.join()
+            self._writer_task.cancel()
+            self._writer_task = None
+            logging.info('FSM group commit stats: %s', self.write_stats())
         if isinstance(self._db, aiosqlite.Connection):
             await self._db.close()
+            self._db = None
 
     async def get_db(self) -> aiosqlite.Connection:
         if isinstance(self._db, aiosqlite.Connection):
             return self._db
 
-        self._db = await aiosqlite.connect(database=self._path_db)
+        async with self._schema_lock:
+            if self._db is None:
+                db = await aiosqlite.connect(database=self._path_db)
+                if self._group_commit:
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=NORMAL")
+                await self._upgrade_schema(db)
+                self._db = db
 
         return self._db
 
+    @contextlib.asynccontextmanager
+    async def _connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Connection for writes: a pooled one if the storage has a pool, otherwise its own
+        """
+        if self._pool is None:
+            yield await self.get_db()
+            return
+        async with self._pool.acquire() as db:
+            if not self._schema_ready:
+                async with self._schema_lock:
+                    if not self._schema_ready:
+                        await self._upgrade_schema(db)
+                        self._schema_ready = True
+            yield db
+
+    @contextlib.asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Connection for reads: the read-only connection of the pool if the storage has one
+        """
+        if self._pool is None:
+            yield await self.get_db()
+            return
+        if not self._schema_ready:
+            async with self._connection():
+                pass
+        async with self._pool.reader() as db:
+            yield db
+
+    @staticmethod
+    async def _upgrade_schema(db: aiosqlite.Connection):
+        """
+        Adds the columns and indexes missing in databases created by older versions
+        """
+        for table in ('aiogram_state', 'aiogram_data'):
+            columns = [row[1] for row in await db.execute_fetchall(f'PRAGMA table_info("{table}")')]
+            if 'touched' not in columns:
+                await db.execute(f'ALTER TABLE "{table}" ADD COLUMN "touched" REAL')
+                await db.execute(f'UPDATE "{table}" SET "touched" = ?', (time.time(),))
+            await db.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_chat_user" ON "{table}"("chat", "user")')
+            await db.execute(f'CREATE INDEX IF NOT EXISTS "{table}_touched" ON "{table}"("touched")')
+        await db.execute('CREATE UNIQUE INDEX IF NOT EXISTS "aiogram_bucket_chat_user" '
+                         'ON "aiogram_bucket"("chat", "user")')
+        await db.commit()
+
+    def write_stats(self) -> Dict:
+        """
+        Statistics of the group commit writer
+        :return: number of batches and writes, batch sizes and commit latency in milliseconds
+        """
+        stats = self._write_stats
+        batches = stats['batches'] or 1
+        return {'batches': stats['batches'],
+                'writes': stats['writes'],
+                'avg_batch_size': round(stats['writes'] / batches, 2),
+                'max_batch_size': stats['max_batch_size'],
+                'avg_commit_ms': round(stats['commit_time'] / batches * 1000, 2),
+                'last_commit_ms': round(stats['last_commit_latency'] * 1000, 2)}
+
+    async def _write(self, statements: List[Tuple[str, tuple]]):
+        """
+        Executes the statements in one transaction and waits until they are committed
+        :param statements: list of (sql, parameters)
+        """
+        if not self._group_commit:
+            async with self._connection() as db:
+                for sql, params in statements:
+                    await db.execute(sql, params)
+                await db.commit()
+            return
+
+        if self._writer_task is None:
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((statements, future))
+        await future
+
+    async def _writer_loop(self):
+        while True:
+            batch = [await self._write_queue.get()]
+            await asyncio.sleep(self._commit_delay)
+            while not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+
+            started = time.perf_counter()
+            try:
+                async with self._connection() as db:
+                    await self._commit_batch(db, batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
+            latency = time.perf_counter() - started
+            stats = self._write_stats
+            stats['batches'] += 1
+            stats['writes'] += len(batch)
+            stats['max_batch_size'] = max(stats['max_batch_size'], len(batch))
+            stats['commit_time'] += latency
+            stats['last_commit_latency'] = latency
+            logging.debug('FSM group commit: %s writes in %.2f ms', len(batch), latency * 1000)
+
+    @staticmethod
+    async def _commit_batch(db: aiosqlite.Connection, batch: List[Tuple[List[Tuple[str, tuple]], asyncio.Future]]):
+        """
+        Commits the writes of the batch in one transaction and resolves their futures
+        """
+        try:
+            for statements, _ in batch:
+                for sql, params in statements:
+                    await db.execute(sql, params)
+            await db.commit()
+        except Exception as e:
+            logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+            await db.rollback()
+            # commit the writes one by one so that only the failing one is rejected
+            for statements, future in batch:
+                try:
+                    for sql, params in statements:
+                        await db.execute(sql, params)
+                    await db.commit()
+                except Exception as write_error:
+                    await db.rollback()
+                    if not future.done():
+                        future.set_exception(write_error)
+                else:
+                    if not future.done():
+                        future.set_result(None)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
     async def wait_closed(self):
         return True
 
+    def _get_entry(self, chat: int, user: int) -> _CacheEntry:
+        """
+        Returns the cache entry of the address, evicting the least recently used ones
+        """
+        key = (chat, user)
+        entry = self._cache.get(key)
+        if entry is None:
+            # evicted entries stay in _dirty until they are flushed
+            entry = self._dirty.get(key) or _CacheEntry()
+            self._cache[key] = entry
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return entry
+
+    def _mark_dirty(self, chat: int, user: int, entry: _CacheEntry, field: str):
+        entry.dirty.add(field)
+        self._dirty[(chat, user)] = entry
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
+
+    async def flush(self):
+        """
+        Writes the changed cache entries to the database in one transaction
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        pending = [(key, entry, entry.dirty) for key, entry in dirty.items()]
+        for _, entry, _ in pending:
+            entry.dirty = set()
+        statements = []
+        for (chat, user), entry, fields in pending:
+            if 'state' in fields:
+                statements.append(self._state_statement(chat, user, entry.state))
+            if 'data' in fields:
+                statements.append(self._data_statement(chat, user, entry.data))
+        try:
+            await self._write(statements)
+        except Exception:
+            # keep the entries dirty so that the next flush retries them
+            for key, entry, fields in pending:
+                entry.dirty |= fields
+                self._dirty.setdefault(key, entry)
+            raise
+
+    @staticmethod
+    def _state_statement(chat: int, user: int, state: Optional[str]) -> Tuple[str, tuple]:
+        if state is not None:
+            return ("""INSERT INTO "aiogram_state"("user", "chat", "state", "touched") VALUES(?, ?, ?, ?)"""
+                    'ON CONFLICT ("user") DO UPDATE SET "state" = excluded."state", "touched" = excluded."touched"',
+                    (user, chat, state, time.time()))
+        return """DELETE FROM "aiogram_state" WHERE chat=? AND "user"=?""", (chat, user)
+
+    def _data_statement(self, chat: int, user: int, data: Optional[Dict]) -> Tuple[str, tuple]:
+        if data:
+            return ("""INSERT INTO "aiogram_data"("user", "chat", "data", "touched") VALUES(?, ?, ?, ?)"""
+                    'ON CONFLICT ("user") DO UPDATE SET "data" = excluded."data", "touched" = excluded."touched"',
+                    (user, chat, self._codec.encode(data), time.time()))
+        return """DELETE FROM "aiogram_data" WHERE "chat"=? AND "user"=?""", (chat, user)
+
+    def _decode(self, blob: str) -> Dict:
+        return codec.decode(blob, self._codecs)
+
+    async def _read_state(self, chat: int, user: int) -> Optional[str]:
+        async with self._reader() as db:
+            async with db.execute("""SELECT "state" FROM "aiogram_state" WHERE "chat"=? AND "user"=?""",
+                                  (chat, user)) as cursor:
+                result = await cursor.fetchone()
+        return result[0] if result else None
+
+    async def _read_data(self, chat: int, user: int) -> Optional[Dict]:
+        async with self._reader() as db:
+            async with db.execute("""SELECT "data" FROM "aiogram_data" WHERE "chat"=? AND "user"=?""",
+                                  (chat, user)) as cursor:
+                result = await cursor.fetchone()
+        return self._decode(result[0]) if result else None
+
     async def set_state(self, *, chat: Union[str, int, None] = None,
                         user: Union[str, int, None] = None,
                         state: Optional[AnyStr] = None):
         chat, user = map(int, self.check_address(chat=chat, user=user))
-        db = await self.get_db()
+        state = self.resolve_state(state)
 
-        if state is not None:
-            await db.execute("""INSERT INTO "aiogram_state" VALUES(?, ?, ?)"""
-                             """ON CONFLICT ("user") DO UPDATE SET "state" = ?""",
-                             (user, chat, self.resolve_state(state), self.resolve_state(state)))
-            await db.commit()
-        else:
-            await db.execute("""DELETE FROM "aiogram_state" WHERE chat=? AND "user"=?""", (chat, user))
-            await db.commit()
+        if self._cache_size:
+            entry = self._get_entry(chat, user)
+            entry.state = state
+            self._mark_dirty(chat, user, entry, 'state')
+            return
+
+        await self._write([self._state_statement(chat, user, state)])
 
     async def get_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                         default: Optional[str] = None) -> Optional[str]:
         chat, user = map(int, self.check_address(chat=chat, user=user))
-        db = await self.get_db()
-        async with db.execute("""SELECT "state" FROM "aiogram_state" WHERE "chat"=? AND "user"=?""",
-                              (chat, user)) as cursor:
-            result = await cursor.fetchone()
-        return result[0] if result else self.resolve_state(default)
+
+        if self._cache_size:
+            entry = self._get_entry(chat, user)
+            if entry.state is _UNSET:
+                state = await self._read_state(chat, user)
+                # a concurrent set_state may have filled the entry while reading
+                if entry.state is _UNSET:
+                    entry.state = state
+            result = entry.state
+        else:
+            result = await self._read_state(chat, user)
+        return result if result is not None else self.resolve_state(default)
 
     async def set_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                        data: Dict = None):
         chat, user = map(int, self.check_address(chat=chat, user=user))
-        db = await self.get_db()
 
-        if data:
-            await db.execute("""INSERT INTO "aiogram_data" VALUES(?, ?, ?)"""
-                             """ON CONFLICT ("user") DO UPDATE SET "data" = ?""",
-                             (user, chat, jsonpickle.encode(data), jsonpickle.encode(data)))
-            await db.commit()
-        else:
-            await db.execute("""DELETE FROM "aiogram_data" WHERE "chat"=? AND "user"=?""", (chat, user))
-            await db.commit()
+        if self._cache_size:
+            entry = self._get_entry(chat, user)
+            entry.data = copy.deepcopy(data) if data else None
+            self._mark_dirty(chat, user, entry, 'data')
+            return
+
+        await self._write([self._data_statement(chat, user, data)])
 
     async def get_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                        default: Optional[dict] = None) -> Dict:
         chat, user = map(int, self.check_address(chat=chat, user=user))
-        db = await self.get_db()
-        async with db.execute("""SELECT "data" FROM "aiogram_data" WHERE "chat"=? AND "user"=?""",
-                              (chat, user)) as cursor:
-            result = await cursor.fetchone()
 
-        return jsonpickle.decode(result[0]) if result else default or {}
+        if self._cache_size:
+            entry = self._get_entry(chat, user)
+            if entry.data is _UNSET:
+                data = await self._read_data(chat, user)
+                if entry.data is _UNSET:
+                    entry.data = data
+            result = copy.deepcopy(entry.data)
+        else:
+            result = await self._read_data(chat, user)
+
+        return result if result else default or {}
 
     async def update_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                           data: Dict = None, **kwargs):
         if data is None:
             data = {}
+        values = {**data, **kwargs}
+        if not self._cache_size and self._can_merge(values):
+            chat, user = map(int, self.check_address(chat=chat, user=user))
+            await self._write([self._merge_statement('aiogram_data', 'data', chat, user, values)])
+            return
+
         temp_data = await self.get_data(chat=chat, user=user, default={})
-        temp_data.update(data, **kwargs)
+        temp_data.update(values)
         await self.set_data(chat=chat, user=user, data=temp_data)
 
+    def _can_merge(self, values: Dict) -> bool:
+        """
+        Checks whether the values can be merged into the stored JSON by SQLite
+        """
+        return bool(values) and isinstance(self._codec, codec.JsonCodec) and \
+            all(isinstance(key, str) and '"' not in key for key in values)
+
+    def _merge_statement(self, table: str, column: str, chat: int, user: int, values: Dict) -> Tuple[str, tuple]:
+        """
+        Upsert that sets the top-level keys of the stored JSON in a single statement,
+        the same way as dict.update does
+        """
+        paths = ', '.join('?, json(?)' for _ in values)
+        params = []
+        for key, value in values.items():
+            params += [f'$."{key}"', json.dumps(value, ensure_ascii=False, separators=(',', ':'))]
+        version = self._codec.version
+        # rows written by the legacy codec have no version byte
+        current = f"""CASE WHEN substr("{column}", 1, 1) = ? THEN substr("{column}", 2) ELSE "{column}" END"""
+        if table == 'aiogram_bucket':
+            sql = (f"""INSERT INTO "{table}" VALUES(?, ?, ?)"""
+                   f"""ON CONFLICT ("user") DO UPDATE SET "{column}" = ? || json_set({current}, {paths})""")
+            return sql, (user, chat, self._codec.encode(values), version, version, *params)
+        sql = (f"""INSERT INTO "{table}"("user", "chat", "{column}", "touched") VALUES(?, ?, ?, ?)"""
+               f"""ON CONFLICT ("user") DO UPDATE SET "touched" = excluded."touched","""
+               f""" "{column}" = ? || json_set({current}, {paths})""")
+        return sql, (user, chat, self._codec.encode(values), time.time(), version, version, *params)
+
     def has_bucket(self):
         return True
 
     async def get_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                          default: Optional[dict] = None) -> Dict:
         chat, user = map(int, self.check_address(chat=chat, user=user))
-        db = await self.get_db()
-        async with db.execute("""SELECT "bucket" FROM "aiogram_bucket" WHERE "chat"=? AND "user"=?""",
-                              (chat, user)) as cursor:
-            result = await cursor.fetchone()
-        return jsonpickle.decode(result[0]) if result else default or {}
+        async with self._reader() as db:
+            async with db.execute("""SELECT "bucket" FROM "aiogram_bucket" WHERE "chat"=? AND "user"=?""",
+                                  (chat, user)) as cursor:
+                result = await cursor.fetchone()
+        return self._decode(result[0]) if result else default or {}
 
     async def set_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                          bucket: Dict = None):
         chat, user = map(int, self.check_address(chat=chat, user=user))
-        db = await self.get_db()
-        await db.execute("""INSERT INTO "aiogram_bucket" VALUES(?, ?, ?)"""
-                         """ON CONFLICT ("user") DO UPDATE SET "bucket" = ?""",
-                         (user, chat, jsonpickle.encode(bucket), jsonpickle.encode(bucket)))
-        await db.commit()
+        encoded = self._codec.encode(bucket)
+        await self._write([("""INSERT INTO "aiogram_bucket" VALUES(?, ?, ?)"""
+                            """ON CONFLICT ("user") DO UPDATE SET "bucket" = ?""",
+                            (user, chat, encoded, encoded))])
 
     async def update_bucket(self, *, chat: Union[str, int, None] = None,
                             user: Union[str, int, None] = None,
                             bucket: Dict = None, **kwargs):
         if bucket is None:
             bucket = {}
+        values = {**bucket, **kwargs}
+        if self._can_merge(values):
+            chat, user = map(int, self.check_address(chat=chat, user=user))
+            await self._write([self._merge_statement('aiogram_bucket', 'bucket', chat, user, values)])
+            return
+
         temp_bucket = await self.get_bucket(chat=chat, user=user)
-        temp_bucket.update(bucket, **kwargs)
+        temp_bucket.update(values)
         await self.set_bucket(chat=chat, user=user, bucket=temp_bucket)
 
     async def reset_all(self, full=True):
-        db = await self.get_db()
-        await db.execute("DROP TABLE aiogram_state")
-        if full:
-            await db.execute("DROP TABLE aiogram_data")
-            await db.execute("DROP TABLE aiogram_bucket")
+        await self.flush()
+        self._cache.clear()
+        async with self._connection() as db:
+            await db.execute("DROP TABLE aiogram_state")
+            if full:
+                await db.execute("DROP TABLE aiogram_data")
+                await db.execute("DROP TABLE aiogram_bucket")
 
-        await db.commit()
+            await db.commit()
+
+    async def migrate_codec(self) -> int:
+        """
+        Rewrites the data and bucket rows written by other codecs with the storage codec
+        :return: number of rewritten rows
+        """
+        await self.flush()
+        rewritten = 0
+        async with self._connection() as db:
+            for table, column in (('aiogram_data', 'data'), ('aiogram_bucket', 'bucket')):
+                rows = await db.execute_fetchall(f"""SELECT "user", "{column}" FROM "{table}" """
+                                                 f"""WHERE substr("{column}", 1, 1) != ?""", (self._codec.version,))
+                await db.executemany(f"""UPDATE "{table}" SET "{column}" = ? WHERE "user" = ?""",
+                                     [(self._codec.encode(self._decode(value)), user) for user, value in rows])
+                rewritten += len(rows)
+            await db.commit()
+        return rewritten
+
+    async def sweep_expired(self, ttl: float, batch_size: int = 500) -> int:
+        """
+        Deletes states and data that were not changed for ttl seconds
+        :param ttl: lifetime of the FSM records in seconds
+        :param batch_size: number of rows deleted in one transaction
+        :return: number of deleted rows
+        """
+        await self.flush()
+        cutoff = time.time() - ttl
+        deleted = 0
+        for table in ('aiogram_state', 'aiogram_data'):
+            while True:
+                async with self._reader() as db:
+                    rows = await db.execute_fetchall(f"""SELECT "chat", "user" FROM "{table}" """
+                                                     f"""WHERE "touched" < ? LIMIT ?""", (cutoff, batch_size))
+                if not rows:
+                    break
+                users = [row[1] for row in rows]
+                placeholders = ', '.join('?' for _ in users)
+                # rows touched after the select are kept
+                await self._write([(f"""DELETE FROM "{table}" WHERE "user" IN ({placeholders}) AND "touched" < ?""",
+                                    (*users, cutoff))])
+                for chat, user in rows:
+                    entry = self._cache.get((chat, user))
+                    if entry is not None and not entry.dirty:
+                        del self._cache[(chat, user)]
+                deleted += len(rows)
+                if len(rows) < batch_size:
+                    break
+        return deleted
+
+    async def iter_states(self, batch_size: int = 500) -> AsyncIterator[Tuple[int, int]]:
+        """
+        Yields (chat, user) of all states, reading the table in batches
+        """
+        await self.flush()
+        async with self._reader() as db:
+            async with db.execute('SELECT "chat", "user" FROM aiogram_state') as cursor:
+                cursor.arraysize = batch_size
+                async for chat, user in cursor:
+                    yield int(chat), int(user)
 
     async def get_states_list(self) -> List[Tuple[int, int]]:
-        db = await self.get_db()
-        async with db.execute("SELECT * FROM aiogram_state") as cursor:
-            items = await cursor.fetchall()
-        return [(int(item[1]), int(item[0])) for item in items]
+        return [address async for address in self.iter_states()]
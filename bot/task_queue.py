@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from pool import ConnectionPool
+
+LOGIN = 2
+SKILL = 6
+RESIDUE = 10
+PRIORITY = 11
+
+
+class TaskQueue:
+    """
+    In-memory queues of the task table, one heap per skill ordered like
+    ORDER BY priority DESC, residue DESC.
+
+    Tasks are handed out from memory; every claim is removed from the task table
+    and journaled in the claim table in one transaction, so it survives a restart.
+    The number of queued tasks of every skill is kept up to date on claim and synchronization.
+    A synchronization rebuilds the heaps in which removed entries outnumber the queued tasks.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._heaps: Dict[str, list] = {}
+        self._entries: Dict[str, list] = {}
+        self._counts: Dict[str, int] = {}
+        # login -> date of the claims made by this process
+        self._claimed: Dict[str, date] = {}
+        self._sequence = itertools.count()
+        self._loaded = False
+        # changed by every synchronization, a load that overlapped one is repeated
+        self._version = 0
+        self._load_lock = asyncio.Lock()
+
+    def _push(self, row: tuple):
+        # [-priority, -residue, sequence, row]; a removed entry keeps its place in the heap with row None
+        entry = [-(row[PRIORITY] or 0), -(row[RESIDUE] or 0), next(self._sequence), row]
+        self._entries[row[LOGIN]] = entry
+        heapq.heappush(self._heaps.setdefault(row[SKILL], []), entry)
+        self._counts[row[SKILL]] = self._counts.get(row[SKILL], 0) + 1
+
+    def _remove(self, login: str) -> Optional[tuple]:
+        entry = self._entries.pop(login, None)
+        if entry is None:
+            return None
+        row, entry[-1] = entry[-1], None
+        self._counts[row[SKILL]] -= 1
+        return row
+
+    def _compact(self, skill: str):
+        heap = self._heaps.get(skill)
+        if heap is not None and len(heap) > 2 * self._counts.get(skill, 0):
+            heap[:] = [entry for entry in heap if entry[-1] is not None]
+            heapq.heapify(heap)
+
+    async def load(self):
+        """
+        Loads the task table into the queues
+        """
+        version = None
+        while version != self._version:
+            version = self._version
+            async with self.pool.reader() as cursor:
+                rows = await cursor.execute_fetchall("SELECT * FROM task")
+        self._heaps = {}
+        self._entries = {}
+        self._counts = {}
+        for row in rows:
+            self._entries[row[LOGIN]] = [-(row[PRIORITY] or 0), -(row[RESIDUE] or 0), next(self._sequence), row]
+        for entry in self._entries.values():
+            self._heaps.setdefault(entry[-1][SKILL], []).append(entry)
+            self._counts[entry[-1][SKILL]] = self._counts.get(entry[-1][SKILL], 0) + 1
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+        self._loaded = True
+        logging.info(f"Task queue loaded: {len(self._entries)} tasks")
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await self.load()
+
+    async def counts(self) -> Dict[str, int]:
+        """
+        :return: skill -> number of queued tasks, kept up to date by the queue
+        """
+        await self._ensure_loaded()
+        return self._counts
+
+    async def claim(self, skill: str, id_telegram: int) -> Optional[tuple]:
+        """
+        Hands out the task with the highest priority and residue of the skill
+        :param skill: skill of the task
+        :param id_telegram: user id telegram
+        :return: row of the task table or None if the skill has no tasks
+        """
+        await self._ensure_loaded()
+        heap = self._heaps.get(skill)
+        while heap:
+            entry = heapq.heappop(heap)
+            if entry[-1] is not None:
+                break
+        else:
+            return None
+
+        row = self._remove(entry[-1][LOGIN])
+        self._claimed[row[LOGIN]] = date.today()
+        try:
+            async with self.pool.acquire() as cursor:
+                await cursor.execute("DELETE FROM task WHERE login = ?", (row[LOGIN],))
+                await cursor.execute("REPLACE INTO claim (login, skill, id, date) VALUES (?, ?, ?, ?)",
+                                     (row[LOGIN], skill, id_telegram, date.today().isoformat()))
+                await cursor.commit()
+        except Exception:
+            # the claim was not written, so the task goes back to the queue
+            del self._claimed[row[LOGIN]]
+            self._push(row)
+            raise
+        return row
+
+    async def apply(self, removed: Iterable[str], rows: Iterable[tuple]):
+        """
+        Applies the changes of a synchronization of the task table
+        :param removed: logins deleted from the table
+        :param rows: inserted and updated rows
+        """
+        self._version += 1
+        if not self._loaded:
+            # the changes are read with the whole table on the first claim
+            return
+        today = date.today()
+        self._claimed = {login: day for login, day in self._claimed.items() if day == today}
+        skills = set()
+        for login in removed:
+            row = self._remove(login)
+            if row is not None:
+                skills.add(row[SKILL])
+        for row in rows:
+            old_row = self._remove(row[LOGIN])
+            if old_row is not None:
+                skills.add(old_row[SKILL])
+            # a claim made while the synchronization was running wins
+            if row[LOGIN] not in self._claimed:
+                self._push(row)
+        for skill in skills:
+            self._compact(skill)
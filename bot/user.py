@@ -1,29 +1,19 @@
-import aiosqlite
 import logging
 
+from identity import IdentityCache
+from pool import ConnectionPool
+from rotation import SkillRotation
+from task_queue import TaskQueue
+
 
 class User:
-    def __init__(self, config):
+    def __init__(self, config, pool: ConnectionPool, task_queue: TaskQueue, rotation: SkillRotation,
+                 identity: IdentityCache):
         self.db = config['db']
-
-    async def __skill_read(self, id_telegram):
-        """
-        Getting skills from the database
-        :param id_telegram: user id telegram
-        :return: list of user skills
-        """
-        async with aiosqlite.connect(self.db) as cursor:
-            cursor_object = await cursor.execute(f"""
-                                SELECT skill FROM user
-                                WHERE id== {id_telegram}
-            """)
-            result = await cursor_object.fetchone()
-            list_support = result[0].split(',')
-            list_support = [i.strip() for i in list_support]
-            if result:
-                return list_support
-            else:
-                logging.warning('User %s was not found and no active skills', id_telegram)
+        self.pool = pool
+        self.task_queue = task_queue
+        self.rotation = rotation
+        self.identity = identity
 
     async def get_name(self, id_telegram):
         """
@@ -32,93 +22,47 @@ class User:
         :return: username
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
-                cursor_object = await cursor.execute(f"""
-                                    select login from user
-                                    where id == {id_telegram}
-                """)
-                result = await cursor_object.fetchone()
-                if result:
-                    return result[0]
+            return (await self.identity.get(id_telegram)).name
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
 
     async def get_localized(self, id_telegram):
         """
-        Method for obtaining username and also access verification
+        Method for obtaining the language of the user
         :param id_telegram: user id telegram
-        :return: username
+        :return: language, ru by default
         """
         try:
-            async with aiosqlite.connect(self.db) as cursor:
-                cursor_object = await cursor.execute(f"""
-                                    select lang from localized
-                                    where id == {id_telegram}
-                """)
-                result = await cursor_object.fetchone()
-                if result:
-                    return result[0]
-                return "ru"
+            return (await self.identity.get(id_telegram)).lang
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
 
     async def get_support_line(self, id_telegram):
         """
-        Get a skill task
+        Get a task of the next user skill that has tasks
         :param id_telegram: user id telegram
         :return:
         """
-        skill = await self.output_skill_counter(id_telegram)
-        async with aiosqlite.connect(self.db) as cursor:
-            cursor_object = await cursor.execute(f"""
-                SELECT * FROM task 
-                WHERE skill='{skill}' 
-                ORDER BY priority DESC, residue DESC LIMIT 1;
-            """)
-            result = await cursor_object.fetchone()
-            if not result:
-                return f"Нет активных задач по навыку {skill}("
-            await cursor.execute(f"""
-                            DELETE FROM task
-                            WHERE login == '{result[2]}'
-            """)
-            await cursor.commit()
+        counts = await self.task_queue.counts()
+        skill = await self.output_skill_counter(id_telegram, lambda i: counts.get(i, 0) > 0)
+        result = await self.task_queue.claim(skill, id_telegram)
+        if not result:
+            return f"Нет активных задач по навыку {skill}("
 
-            return result
+        return result
 
-    async def output_skill_counter(self, id_telegram):
+    async def output_skill_counter(self, id_telegram, available=None):
         """
-        The method gets a counter from the database and checks it by condition, incrementing or zeroing it.
+        The method takes the counter from the rotation cache and checks it by condition, incrementing or zeroing it.
         Returns the skill that will be used
         :param id_telegram: user id telegram
+        :param available: whether the skill has tasks, skills without them are skipped
         :return: skill
         """
         try:
-            list_skill = await self.__skill_read(id_telegram)
-            async with aiosqlite.connect(self.db) as cursor:
-                cursor_object = await cursor.execute(f"""
-                                    select num from user
-                                    where id == {id_telegram}
-                """)
-                result = await cursor_object.fetchone()
-                counter = result[0]
-
-                if len(list_skill) - 1 > int(counter):
-                    counter += 1
-                else:
-                    counter = 0
-
-                await cursor.execute(f"""
-                                    UPDATE user
-                                    SET (num) = ('{counter}')
-                                     where id == {id_telegram} 
-                """)
-
-                await cursor.commit()
-
-            return list_skill[counter]
+            return await self.rotation.next_skill(id_telegram, available)
         except Exception as e:
             logging.error(f"An error occurred: {e.__class__.__name__} - {e}")
             raise e
@@ -1,10 +1,12 @@
 from .admin_validation import AdminCreate
 from .support_validation import SupportCreate
+from .support_batch_validation import SupportBatch
 from .task_validation import TaskCreate
 from .user_validation import UserCreate
 
 __all__ = [
     'SupportCreate',
+    'SupportBatch',
     'AdminCreate',
     'UserCreate',
     'TaskCreate'
@@ -0,0 +1,138 @@
+import timeit
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .support_validation import SupportCreate
+
+_STATUSES = frozenset(("", "НЕ ДЕКРЕТ"))
+_EMPTY_DATES = frozenset(("", "-"))
+_COLUMNS = 11
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(v: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(v, '%d.%m.%Y')
+    except ValueError:
+        return None
+
+
+def _date_ok(v, now: datetime) -> bool:
+    if v in _EMPTY_DATES:
+        return True
+    parsed = _parse_date(v) if type(v) is str else None
+    return parsed is not None and parsed < now
+
+
+def _fast_int(v):
+    """
+    Converts plain digits without pydantic, returns None when pydantic has to decide
+    """
+    if type(v) is int:
+        return v
+    if type(v) is str and v.isascii() and v.isdigit():
+        return int(v)
+    return None
+
+
+class SupportBatch:
+    """
+    Column-wise validation of the support rows with the same rules as SupportCreate.
+
+    Rows whose numbers are not plain digits are checked with SupportCreate itself.
+
+    Attributes:
+        rows (list): valid rows as tuples in the column order of the task table, ready for executemany.
+        rejects (list): (index of the row, reason) of the rejected rows.
+    """
+
+    def __init__(self, rows: List[tuple], rejects: List[Tuple[int, str]]):
+        self.rows = rows
+        self.rejects = rejects
+
+    @classmethod
+    def validate(cls, matrix: List[list], now: Optional[datetime] = None) -> 'SupportBatch':
+        """
+        Validates the rows of the A:K range of the support sheet
+        :param matrix: rows of the sheet
+        :param now: time the dates are compared with
+        :return: valid rows and rejects
+        """
+        now = now or datetime.now()
+        rejects = []
+        indexes = []
+        for index, row in enumerate(matrix):
+            if len(row) == _COLUMNS:
+                indexes.append(index)
+            else:
+                rejects.append((index, f'List should contain {_COLUMNS} values'))
+        if not indexes:
+            return cls([], rejects)
+
+        (status, dates, login, link, comment, skillsup,
+         skill, output, appreciated, autochecks, residue) = zip(*(matrix[i] for i in indexes))
+
+        status_ok = [v in _STATUSES for v in status]
+        date_ok = [_date_ok(v, now) for v in dates]
+        text_ok = [all(type(v) is str for v in values)
+                   for values in zip(login, link, comment, skillsup, skill, output)]
+        appreciated_int = [_fast_int(v) for v in appreciated]
+        residue_int = [_fast_int(v) for v in residue]
+        autochecks_ok = [type(v) in (int, str) for v in autochecks]
+
+        rows = []
+        for n, index in enumerate(indexes):
+            if not status_ok[n]:
+                rejects.append((index, f'Incorrect status: {status[n]}'))
+            elif not date_ok[n]:
+                rejects.append((index, f'Incorrect date: {dates[n]}'))
+            elif residue_int[n] == 0:
+                rejects.append((index, f'Incorrect residue: {residue[n]}'))
+            elif text_ok[n] and autochecks_ok[n] and appreciated_int[n] is not None and residue_int[n] is not None:
+                rows.append((status[n], dates[n], login[n], link[n], comment[n], skillsup[n], skill[n],
+                             output[n], appreciated_int[n], autochecks[n], residue_int[n]))
+            else:
+                try:
+                    rows.append(tuple(SupportCreate.from_list(matrix[index]).model_dump().values()))
+                except (ValueError, ValidationError) as e:
+                    rejects.append((index, str(e)))
+        rejects.sort()
+        return cls(rows, rejects)
+
+
+def benchmark(number: int = 5, size: int = 20000):
+    """
+    Compares SupportBatch with the validation of every row by SupportCreate
+    :param number: number of runs
+    :param size: number of rows
+    """
+    matrix = [['status', 'date', 'login', 'link', 'comment', 'skillsup', 'skill', 'output',
+               'appreciated', 'autochecks', 'residue']]
+    for i in range(size):
+        matrix.append(['' if i % 10 else 'НЕ ДЕКРЕТ', f'{i % 28 + 1:02}.0{i % 9 + 1}.2023' if i % 3 else '-',
+                       f'support_{i}', f'https://example.com/{i}', '', 'group', f'skill_{i % 7}', '95%',
+                       str(i % 40), str(i % 5), str(i % 30)])
+
+    def per_row():
+        result = []
+        for row in matrix:
+            try:
+                result.append(SupportCreate.from_list(row).model_dump())
+            except (ValueError, ValidationError, IndexError):
+                continue
+        return result
+
+    def batch():
+        return SupportBatch.validate(matrix).rows
+
+    assert [tuple(i.values()) for i in per_row()] == batch()
+    for name, fn in (('per row', per_row), ('batch', batch)):
+        elapsed = timeit.timeit(fn, number=number) / number
+        print(f'{name:<8} {elapsed * 1000:8.1f} ms for {len(matrix)} rows')
+
+
+if __name__ == '__main__':
+    benchmark()
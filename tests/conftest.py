@@ -0,0 +1,32 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# the bot modules import each other by their module names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'bot'))
+
+from admin import Admin  # noqa: E402
+from identity import IdentityCache  # noqa: E402
+from pool import ConnectionPool  # noqa: E402
+from rotation import SkillRotation  # noqa: E402
+from task_queue import TaskQueue  # noqa: E402
+
+SKILLS = ('chat', 'mail')
+TASKS_PER_SKILL = 100
+
+
+@pytest.fixture
+def database(tmp_path) -> str:
+    """
+    Database created by Admin with TASKS_PER_SKILL tasks of every skill
+    """
+    path = str(tmp_path / 'database.db')
+    pool = ConnectionPool(path)
+    Admin({'db': path}, pool, TaskQueue(pool), SkillRotation(pool), IdentityCache(pool))
+    rows = [('new', '01.01.23', f'{skill}_{number}', '', '', '', skill, '', 0, 0, number % 7, number % 3)
+            for skill in SKILLS for number in range(TASKS_PER_SKILL)]
+    with sqlite3.connect(path) as db:
+        db.executemany("INSERT INTO task VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return path
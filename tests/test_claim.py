@@ -0,0 +1,45 @@
+import asyncio
+import sqlite3
+
+from conftest import SKILLS, TASKS_PER_SKILL
+from pool import ConnectionPool
+from task_queue import TaskQueue
+
+
+def test_concurrent_claims_hand_out_every_login_once(database):
+    async def claim_all():
+        pool = ConnectionPool(database, size=4)
+        queue = TaskQueue(pool)
+        try:
+            # more claims than tasks, so the last ones find the queues empty
+            claims = await asyncio.gather(*(queue.claim(SKILLS[number % 2], number)
+                                            for number in range(3 * TASKS_PER_SKILL)))
+            return claims, await queue.counts()
+        finally:
+            await pool.close()
+
+    claims, counts = asyncio.run(claim_all())
+
+    logins = [row[2] for row in claims if row is not None]
+    assert len(logins) == len(set(logins)) == len(SKILLS) * TASKS_PER_SKILL
+    assert claims.count(None) == TASKS_PER_SKILL
+    assert counts == {skill: 0 for skill in SKILLS}
+    with sqlite3.connect(database) as db:
+        assert db.execute("SELECT count(*) FROM task").fetchone() == (0,)
+        journal = db.execute("SELECT login FROM claim").fetchall()
+    assert sorted(login for login, in journal) == sorted(logins)
+
+
+def test_claims_follow_priority_and_residue(database):
+    async def claim_skill():
+        pool = ConnectionPool(database, size=4)
+        queue = TaskQueue(pool)
+        try:
+            return await asyncio.gather(*(queue.claim('chat', number) for number in range(TASKS_PER_SKILL)))
+        finally:
+            await pool.close()
+
+    claims = asyncio.run(claim_skill())
+
+    order = [(row[11], row[10]) for row in claims]
+    assert order == sorted(order, reverse=True)
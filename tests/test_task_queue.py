@@ -0,0 +1,94 @@
+import asyncio
+import contextlib
+
+from admin import Admin
+from conftest import SKILLS, TASKS_PER_SKILL
+from identity import IdentityCache
+from pool import ConnectionPool
+from rotation import SkillRotation
+from task_queue import TaskQueue
+
+
+def test_priority_updates_do_not_grow_the_heaps(database):
+    pool = ConnectionPool(database, size=4)
+    queue = TaskQueue(pool)
+    # Admin prepares the database with asyncio.run, so it is created outside of the loop
+    admin = Admin({'db': database}, pool, queue, SkillRotation(pool), IdentityCache(pool))
+
+    async def set_priorities():
+        try:
+            await queue.counts()
+            for level in range(20):
+                await admin.priority_setting([f'* {level}'])
+            claimed = await queue.claim('chat', 1)
+            return claimed
+        finally:
+            await pool.close()
+
+    claimed = asyncio.run(set_priorities())
+
+    assert claimed[11] == 19
+    for skill in SKILLS:
+        live = sum(entry[-1] is not None for entry in queue._heaps[skill])
+        assert len(queue._heaps[skill]) <= 2 * TASKS_PER_SKILL
+        assert live == queue._counts[skill]
+
+
+def test_synchronization_during_the_first_load_is_not_lost(database):
+    pool = ConnectionPool(database, size=4)
+    queue = TaskQueue(pool)
+    admin = Admin({'db': database}, pool, queue, SkillRotation(pool), IdentityCache(pool))
+    header = ['status', 'date', 'login', 'link', 'comment', 'skillsup', 'skill', 'output',
+              'appreciated', 'autochecks', 'residue']
+    rows = [header, ['', '-', 'chat_new', 'l', '', 'g', 'chat', 'o', '1', '1', '5']]
+
+    async def load_and_synchronize():
+        synchronized = asyncio.Event()
+        reader = pool.reader
+
+        @contextlib.asynccontextmanager
+        async def slow_reader():
+            async with reader() as cursor:
+                execute_fetchall = cursor.execute_fetchall
+
+                async def read_before_synchronization(*args):
+                    result = await execute_fetchall(*args)
+                    await synchronized.wait()
+                    return result
+
+                cursor.execute_fetchall = read_before_synchronization
+                try:
+                    yield cursor
+                finally:
+                    del cursor.execute_fetchall
+
+        pool.reader = slow_reader
+        load = asyncio.create_task(queue.counts())
+        await asyncio.sleep(0.1)
+        pool.reader = reader
+        await admin.unloading(rows, force=True)
+        synchronized.set()
+        try:
+            return dict(await load)
+        finally:
+            await pool.close()
+
+    counts = asyncio.run(load_and_synchronize())
+
+    assert counts == {'chat': 1}
+
+
+def test_invalid_priority_levels_are_reported(database):
+    pool = ConnectionPool(database, size=4)
+    queue = TaskQueue(pool)
+    admin = Admin({'db': database}, pool, queue, SkillRotation(pool), IdentityCache(pool))
+
+    async def set_priorities():
+        try:
+            return await admin.priority_setting(['chat_1 --5', 'chat_2 ²', 'chat_3 -2', 'chat_4'])
+        finally:
+            await pool.close()
+
+    report = asyncio.run(set_priorities())
+
+    assert report.splitlines() == ['chat_3 -2:✅', 'chat_4 1:✅', 'chat_1 --5:❌', 'chat_2 ²:❌']
@@ -0,0 +1,40 @@
+import asyncio
+
+from admin import Admin
+from identity import IdentityCache
+from pool import ConnectionPool
+from rotation import SkillRotation
+from task_queue import TaskQueue
+
+
+def sheet(logins):
+    return [['', '-', login, '', '', '', 'chat', '', '0', '0', '1'] for login in logins]
+
+
+def test_unchanged_chunks_are_staged_once_a_chunk_differs(tmp_path):
+    path = str(tmp_path / 'database.db')
+    pool = ConnectionPool(path)
+    admin = Admin({'db': path}, pool, TaskQueue(pool), SkillRotation(pool), IdentityCache(pool))
+    chunks = [sheet(f'login_{chunk}_{number}' for number in range(10)) for chunk in range(3)]
+
+    async def iterate(rows):
+        for chunk in rows:
+            yield chunk
+
+    async def synchronize():
+        try:
+            return [await admin.unloading(iterate(chunks)),
+                    await admin.unloading(iterate(chunks)),
+                    # the last chunk differs, the first two are staged from the temporary table
+                    await admin.unloading(iterate([*chunks[:2], sheet(['login_new'])])),
+                    # the sheet got shorter
+                    await admin.unloading(iterate(chunks[:1]))]
+        finally:
+            await pool.close()
+
+    first, second, changed, shorter = asyncio.run(synchronize())
+
+    assert first['inserted'] == 30
+    assert second['skipped']
+    assert (changed['accepted'], changed['inserted'], changed['deleted']) == (21, 1, 10)
+    assert (shorter['accepted'], shorter['inserted'], shorter['deleted']) == (10, 0, 11)